@@ -1,9 +1,42 @@
 from django.apps import AppConfig
 from django.conf import settings
+import logging
 
 # Default settings
 _DEFAULTS = {
     'AUTHORIZE_GLOBAL': False,      # Allow authorizing for other apps?
+    'AUTHORITY_CACHE_SECONDS': 3600,    # How long to cache user authorities (changes are applied immediately)
+    'AVATAR_CACHE_SECONDS': 3600,       # How long to cache social account avatar URLs
+    'PAGINATION_SIGNED_STATE': False,   # Track pagination sort/page/filters in a signed URL token, not the session
+
+    # Request timelines (durations of auth, xss, flash, view, render, etc)
+    'TIMELINE_AUTHORITIES': "~superuser",   # Who receives the Server-Timing response header
+    'TIMELINE_SPANS': False,                # Include Log.trace/Log.end spans (resolves callers on every trace)
+    'TIMELINE_FILE': None,                  # Path of a file to append timelines to, as JSON lines
+
+    # Asynchronous logging: 'base' logger handlers run on a background thread, behind a bounded queue
+    'LOG_QUEUE': False,
+    'LOG_QUEUE_SIZE': 10000,
+    'LOG_QUEUE_OVERFLOW': 'drop_new',       # drop_new, drop_oldest, or block
+    'LOG_QUEUE_FILE': None,                 # Path of a file to write 'base' log records to (in batches)
+    'LOG_QUEUE_BATCH_SIZE': 100,
+    'LOG_QUEUE_FLUSH_SECONDS': 1,
+
+    # Gravatar images (fetched in the background and served locally)
+    'GRAVATAR_URL': "https://www.gravatar.com/avatar/",
+    'GRAVATAR_TIMEOUT': (2, 3),         # (connect, read) seconds
+    'GRAVATAR_CACHE_SECONDS': 86400,
+
+    # Built-in Dynamic Roles ('~role_name' is satisfied by any of the listed authority codes)
+    # Roles in the project's DYNAMIC_ROLES setting are added to these
+    'MJG_BASE_DYNAMIC_ROLES': {
+        'power_user': ['security_admin', 'admin', 'developer'],
+        'superuser': ['developer'],
+        'impersonate': ['developer'],
+        'contact_admin': ['admin', 'contact_admin'],
+        'security_admin': ['admin', 'security_admin'],
+        'proxy': ['admin', 'proxy'],
+    },
 
     # Admin Menu Items
     'MJG_BASE_ADMIN_LINKS': [
@@ -38,6 +71,47 @@ class MjgBaseConfig(AppConfig):
             if mm not in settings.MIDDLEWARE:
                 settings.MIDDLEWARE.append(mm)
 
+        # Snapshot frequently-checked settings (environment, debug, etc)
+        from .services import utility_service
+        utility_service.refresh_settings_snapshot()
+
+        # Record installed plugins and their versions
+        utility_service.refresh_plugin_registry()
+
+        # Write request timelines to a file, if requested
+        timeline_file = utility_service.get_setting('TIMELINE_FILE')
+        if timeline_file:
+            timeline_logger = logging.getLogger('base.timeline')
+            handler = logging.FileHandler(timeline_file)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            timeline_logger.addHandler(handler)
+            timeline_logger.setLevel(logging.INFO)
+            timeline_logger.propagate = False
+
+        # Move log I/O off the request path, if requested
+        if utility_service.get_setting('LOG_QUEUE'):
+            from .classes import log_queue
+            for logger_name in ['base', 'base.timeline']:
+                log_queue.install(
+                    logger_name,
+                    queue_size=utility_service.get_setting('LOG_QUEUE_SIZE'),
+                    overflow=utility_service.get_setting('LOG_QUEUE_OVERFLOW'),
+                    filename=utility_service.get_setting('LOG_QUEUE_FILE') if logger_name == 'base' else None,
+                    batch_size=utility_service.get_setting('LOG_QUEUE_BATCH_SIZE'),
+                    flush_seconds=utility_service.get_setting('LOG_QUEUE_FLUSH_SECONDS'),
+                )
+
+        # Invalidate cached authorities and avatars when permissions or accounts change
+        from . import signals
+
+        # Compile dynamic roles declared in settings and plugins
+        from .classes.dynamic_role import DynamicRole
+        DynamicRole.compile()
+
+        # Compile admin menu links declared in settings and plugins
+        from .classes.admin_link import AdminLink
+        AdminLink.compile()
+
     # Assign default setting values
     for key, value in _DEFAULTS.items():
         try:
@@ -0,0 +1,118 @@
+from ..services import utility_service, auth_service
+from .log import Log
+from django.urls import reverse
+
+log = Log()
+
+
+class AdminLink:
+    """
+    An item in the admin (settings) menu.
+
+    Links are declared in <PLUGIN>_ADMIN_LINKS settings or _DEFAULTS entries, as dicts of
+    {'url', 'label', 'icon', 'authorities', 'feature', 'nonprod_only'}.
+    The registry is compiled once (at AppConfig.ready) into a list sorted by label, with authority
+    strings pre-split. URLs are reversed the first time they are needed (after the URLconf is loaded).
+    """
+
+    # Tuple of AdminLinks, sorted by label
+    registry = None
+
+    url = None
+    label = None
+    icon = None
+    feature = None
+    nonprod_only = False
+
+    # Tuple of authority codes (any one is required). If None, the link is for power users
+    authorities = None
+
+    # Reversed URL
+    _path = None
+    _resolved = False
+
+    @classmethod
+    def compile(cls):
+        plugins = dict(utility_service.get_installed_plugins())
+        app_code = utility_service.get_app_code()
+        if app_code:
+            plugins[app_code.lower()] = utility_service.get_app_version()
+
+        links = []
+        for plugin in plugins:
+            if plugin.lower().startswith("django"):
+                continue
+            setting_name = f"{plugin.upper().replace('-', '_')}_ADMIN_LINKS"
+            for attrs in utility_service.get_plugin_setting(plugin, setting_name, None) or []:
+                links.append(cls(attrs))
+
+        cls.registry = tuple(sorted(links, key=lambda i: i.label))
+        log.debug(f"Compiled {len(cls.registry)} admin links")
+
+    @classmethod
+    def get_registry(cls):
+        if cls.registry is None:
+            cls.compile()
+        return cls.registry
+
+    @classmethod
+    def get_allowed(cls):
+        """
+        Get the admin links the current user is allowed to see
+        """
+        return [link for link in cls.get_registry() if link.is_allowed()]
+
+    @property
+    def path(self):
+        if not self._resolved:
+            self._path = self._resolve_path()
+            self._resolved = True
+        return self._path
+
+    def is_allowed(self):
+        # If marked as non-prod only, do not include in prod
+        if self.nonprod_only and utility_service.is_production():
+            return False
+
+        # Item is allowed for all admins and developers if no authorities are specified
+        if self.authorities is None:
+            return auth_service.has_authority('~power_user')
+        return bool(self.authorities) and auth_service.has_authority(self.authorities)
+
+    def _resolve_path(self):
+        if not self.url:
+            log.warn(f"No URL was provided for admin link: {self.label}")
+            return None
+        elif self.url == '/' or '/' in self.url:
+            return self.url
+        try:
+            return reverse(self.url)
+        except Exception as ee:
+            log.debug(f"Path comparison error: {str(ee)}")
+            return None
+
+    def __init__(self, attrs):
+        self.url = attrs.get('url')
+        self.label = attrs.get('label', self.url) or ''
+        self.icon = attrs.get('icon', 'fa-link')
+        self.feature = attrs.get('feature')
+        self.nonprod_only = attrs.get('nonprod_only', False)
+
+        authorities = attrs.get('authorities')
+        if authorities and type(authorities) is str:
+            authorities = utility_service.csv_to_list(authorities)
+
+        if not authorities:
+            self.authorities = None
+        elif type(authorities) in (list, tuple):
+            self.authorities = tuple(authorities)
+        else:
+            # Empty tuple: never allowed
+            self.authorities = ()
+            log.warn(f"Invalid authority list was provided. Menu item will not be displayed: {self.label}")
+
+    def __str__(self):
+        return f"{self.label} ({self.url})"
+
+    def __repr__(self):
+        return str(self)
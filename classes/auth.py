@@ -5,12 +5,24 @@ log = Log()
 
 session_var = "auth_tracking_dict"
 
+# Version of the session snapshot format. Snapshots from other versions are discarded.
+snapshot_version = 2
+
+# Attribute holding the request-scoped Auth instance (see auth_service.get_auth_instance)
+request_attr = "_mjg_auth"
+
 
 class Auth:
     authenticated_user = None
     impersonated_user = None
     proxied_user = None
 
+    # The request.user this instance was built from
+    source_user = None
+
+    # The snapshot last read from or written to the session
+    saved_snapshot = None
+
     def is_logged_in(self):
         return self.authenticated_user and self.authenticated_user.is_logged_in()
 
@@ -34,7 +46,21 @@ class Auth:
 
     def save(self):
         self._clean_users()
-        utility_service.set_session_var(session_var, self._to_dict())
+        # Only write to the session when the snapshot has actually changed
+        snapshot = self._to_dict()
+        if snapshot != self.saved_snapshot:
+            utility_service.set_session_var(session_var, snapshot)
+            self.saved_snapshot = snapshot
+        # This instance now reflects the session, so make it the one used for the rest of the request
+        self.attach_to_request()
+
+    def attach_to_request(self):
+        """
+        Make this the Auth instance returned for the remainder of the current request
+        """
+        request = utility_service.get_request()
+        if request is not None:
+            setattr(request, request_attr, self)
 
     def can_impersonate(self):
         return self.authenticated_user.has_authority('~impersonate')
@@ -51,6 +77,7 @@ class Auth:
                 return True
             iu = AuthUser(user_data)
             if iu and iu.is_valid():
+                iu.link_contact()
                 self.impersonated_user = iu
                 self.save()
 
@@ -94,6 +121,7 @@ class Auth:
 
     def reset_session(self):
         utility_service.clear_custom_session_vars()
+        self.saved_snapshot = None
         self.impersonated_user = None
         self.proxied_user = None
         self.save()
@@ -102,6 +130,7 @@ class Auth:
         # Get Django.auth.User
         request = utility_service.get_request()
         user_instance = request.user
+        self.source_user = user_instance
 
         # If user is not authenticated, there is nothing to process
         if not user_instance.is_authenticated:
@@ -116,25 +145,36 @@ class Auth:
 
             # If authentication has not changed, no further processing required
             if self.authenticated_user and user_instance.email == self.authenticated_user.email:
-                self._clean_users()
+                # Unless authorities were reloaded due to a permission starting or ending
+                if self._was_refreshed():
+                    self.save()
+                else:
+                    self._clean_users()
                 return
 
         # Generate new auth data
         # ===============================================================
         self.authenticated_user = AuthUser(user_instance)
+        # Names from an existing Contact must be in the snapshot, since display names are read from it
+        self.authenticated_user.link_contact()
         self.impersonated_user = None
         self.proxied_user = None
         self.save()
 
     def _resume(self):
         data = utility_service.get_session_var(session_var)
-        if data:
+        if data and data.get('version') == snapshot_version:
+            self.saved_snapshot = data
             for au in ['authenticated_user', 'impersonated_user', 'proxied_user']:
                 if data.get(au):
                     setattr(self, au, AuthUser(data.get(au)))
 
+    def _was_refreshed(self):
+        return any(au and au.refreshed for au in [self.authenticated_user, self.impersonated_user, self.proxied_user])
+
     def _to_dict(self):
         return {
+            'version': snapshot_version,
             'authenticated_user': self.authenticated_user.to_dict() if self.authenticated_user else None,
             'impersonated_user': self.impersonated_user.to_dict() if self.impersonated_user else None,
             'proxied_user': self.proxied_user.to_dict() if self.proxied_user else None,
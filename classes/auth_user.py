@@ -1,10 +1,10 @@
 from .log import Log
-from ..services import utility_service, error_service
+from ..services import utility_service, error_service, permission_service, contact_service
 from ..classes.dynamic_role import DynamicRole
 from django.contrib.auth.models import User
 from ..models.contact.contact import Contact
-from django.db.models import Q
-from datetime import datetime
+from django.db.models import Q, Prefetch, prefetch_related_objects
+from functools import lru_cache
 log = Log()
 
 
@@ -17,8 +17,22 @@ class AuthUser:
     email = None
     is_proxied = None
 
+    user_id = None
+
     # Authority Codes
-    authorities = None
+    authority_codes = None
+
+    # Authority codes plus satisfied dynamic roles (lower-case, i.e. {'admin', '~power'})
+    effective_authorities = frozenset()
+
+    # When authorities will next change (epoch seconds), due to a permission's effective/end date
+    authorities_expire = None
+
+    # Permissions version the authorities were loaded from (see permission_service.get_version)
+    permissions_version = None
+
+    # Were authorities re-loaded while resuming from the session?
+    refreshed = False
 
     # Holders for other classes
     user_instance = None
@@ -32,53 +46,79 @@ class AuthUser:
 
     @property
     def id(self):
+        if self.user_id:
+            return self.user_id
         try:
-            return self.django_user().id
+            self.user_id = self.django_user().id
+            return self.user_id
         except Exception as ee:
             log.trace([self])
             log.error(ee)
 
+    @property
+    def authorities(self):
+        """
+        Dict of {authority_code: authority_title}. Titles are only looked up when needed.
+        """
+        if self.authority_codes is None:
+            return None
+        return permission_service.get_authority_titles(self.authority_codes)
+
     def contact(self):
         self._get_contact_instance()
         return self.contact_instance
 
     def display_name(self):
-        return f"{self.first_name} {self.last_name}".strip()
+        name = f"{self.first_name or ''} {self.last_name or ''}".strip()
+        return name if name else (self.username or self.email or '')
+
+    def link_contact(self):
+        """
+        If an existing Contact has this user's email, link it now (copying its names to the user).
+        Called when a user is first authenticated, so that the session snapshot has the Contact's names.
+        New Contacts are still only created on first use of contact()
+        """
+        self._get_user_instance()
+        if self.contact_instance or not self.user_instance:
+            return
+
+        try:
+            self.contact_instance = self.user_instance.contact
+        except Contact.DoesNotExist:
+            if Contact.objects.filter(email=self.email).exists():
+                self._get_contact_instance()
 
     def has_authority(self, authority_list):
         """
         Does this user have the specified authority?
         If a list of authorities is given, only one of the authorities is required
         """
+        return self.has_any_authority(authority_list)
+
+    def has_any_authority(self, authority_list):
+        """
+        Does this user have at least one of the specified authorities?
+        """
         try:
             # If user has no authorities, no need to process anything
-            if not self.authorities:
+            if not self.effective_authorities:
                 return False
-
-            # If not already a list, make it so
-            if type(authority_list) is not list:
-                if ',' in authority_list:
-                    authority_list = utility_service.csv_to_list(authority_list)
-                else:
-                    authority_list = [authority_list]
-
-            # Expand out any dynamic roles
-            master_list = []
-            for authority_code in authority_list:
-                if authority_code.startswith('~'):
-                    master_list.extend(DynamicRole().get(authority_code))
-                else:
-                    master_list.append(authority_code)
-            del authority_list
-
-            # Look for any one matching authority
-            for authority_code in master_list:
-                if authority_code.lower() in self.authorities:
-                    return True
+            return not self.effective_authorities.isdisjoint(authority_keys(authority_list))
         except Exception as ee:
             error_service.record(ee, "Error checking user authorities")
+        return False
 
-        # False if not found
+    def has_all_authorities(self, authority_list):
+        """
+        Does this user have every one of the specified authorities?
+        """
+        try:
+            keys = authority_keys(authority_list)
+            if not (keys and self.effective_authorities):
+                return False
+            return self.effective_authorities.issuperset(keys)
+        except Exception as ee:
+            error_service.record(ee, "Error checking user authorities")
         return False
 
     def is_logged_in(self):
@@ -98,46 +138,108 @@ class AuthUser:
 
     def to_dict(self):
         return {
+            'id': self.user_id,
             'is_authenticated': self.is_authenticated,
             'first_name': self.first_name,
             'last_name': self.last_name,
             'username': self.username,
             'email': self.email,
             'is_proxied': self.is_proxied,
-            'authorities': self.authorities,
+            'authority_codes': self.authority_codes,
+            'authorities_expire': self.authorities_expire,
+            'permissions_version': self.permissions_version,
         }
 
-    def __init__(self, user_data):
+    @classmethod
+    def bulk_load(cls, user_data_list):
+        """
+        Get populated AuthUsers for a list of user IDs and/or email addresses.
+        Uses a fixed number of queries regardless of list size (users with contacts, then permissions)
+        Returns a list of AuthUsers in the order given. Users that could not be found are omitted.
+        """
+        log.trace([user_data_list])
+        user_ids = [int(xx) for xx in user_data_list if str(xx).isnumeric()]
+        emails = [xx for xx in user_data_list if '@' in str(xx)]
+        if not (user_ids or emails):
+            return []
+
+        users = list(User.objects.filter(Q(pk__in=user_ids) | Q(email__in=emails)).select_related('contact'))
+
+        # Versions are read before permissions are loaded, so a concurrent change is never missed
+        versions = permission_service.get_versions([uu.id for uu in users])
+        prefetch_related_objects(
+            users,
+            Prefetch('permissions', queryset=permission_service.get_pending_permissions(), to_attr='pending_permissions')
+        )
+
+        by_id = {}
+        by_email = {}
+        for uu in users:
+            au = cls(uu, get_related=False)
+            snapshot = permission_service.build_snapshot(uu.pending_permissions)
+            snapshot['version'] = versions.get(uu.id)
+            au._set_authorities(snapshot)
+            try:
+                au.contact_instance = uu.contact
+            except Contact.DoesNotExist:
+                # Contact will be created on first use of contact()
+                au.contact_instance = None
+            by_id[uu.id] = au
+            by_email[uu.email] = au
+
+        results = []
+        for xx in user_data_list:
+            au = by_id.get(int(xx)) if str(xx).isnumeric() else by_email.get(xx)
+            if au and au not in results:
+                results.append(au)
+
+        log.end(len(results))
+        return results
+
+    def __init__(self, user_data, get_related=True):
         # If anonymous
         if user_data is None:
             self.is_authenticated = False
             self.first_name = 'Anonymous'
-            self.authorities = []
+            self.authority_codes = []
             return
 
         # If resuming
         elif type(user_data) is dict:
+            self.user_id = user_data.get('id')
             self.is_authenticated = user_data.get('is_authenticated')
             self.first_name = user_data.get('first_name')
             self.last_name = user_data.get('last_name')
             self.email = user_data.get('email')
             self.username = user_data.get('username')
             self.is_proxied = user_data.get('is_proxied')
-            self.authorities = user_data.get('authorities')
+            self.authority_codes = user_data.get('authority_codes')
+            self.authorities_expire = user_data.get('authorities_expire')
+            self.permissions_version = user_data.get('permissions_version')
+
+            # If permissions changed, or one has started or ended since the snapshot was taken, reload authorities
+            if self.is_authenticated and (
+                permission_service.is_expired(self.authorities_expire)
+                or permission_service.get_version(self.id) != self.permissions_version
+            ):
+                self._populate_authorities(force=True)
+                self.refreshed = True
+            else:
+                self._compile_authorities()
             return
 
         # New from Django User
         elif type(user_data) is User or 'django' in str(type(user_data)):
             log.trace([user_data])
             self.user_instance = user_data
-            self._populate_from_user()
+            self._populate_from_user(get_related)
 
         # New from Django User ID
         elif str(user_data).isnumeric():
             log.trace([user_data])
             try:
                 self.user_instance = User.objects.get(pk=user_data)
-                self._populate_from_user()
+                self._populate_from_user(get_related)
             except User.DoesNotExist:
                 self.user_instance = None
 
@@ -150,34 +252,43 @@ class AuthUser:
             if not self.user_instance:
                 self.email = None
             else:
-                self._populate_from_user()
+                self._populate_from_user(get_related)
         
     def _populate_from_user(self, get_related=True):
         if self.user_instance:
+            self.user_id = self.user_instance.id
             self.is_authenticated = self.user_instance.is_authenticated
             self.first_name = self.user_instance.first_name
             self.last_name = self.user_instance.last_name
             self.email = self.user_instance.email
             self.username = self.user_instance.username
+            # Contact is provisioned on first use of contact(), keeping writes out of authentication
             if get_related:
                 self._populate_authorities()
-                self._get_contact_instance()
 
     def _populate_authorities(self, force=False):
-        if force or self.authorities is None:
-            self.authorities = {}
-            self._get_user_instance()
-            if self.user_instance and self.is_authenticated:
+        if force or self.authority_codes is None:
+            self.authority_codes = []
+            if self.is_authenticated and self.id:
                 log.trace()
                 try:
-                    now = datetime.now()
-                    permissions = self.user_instance.permissions.filter(Q(effective_date__isnull=True) | Q(effective_date__lte=now))
-                    permissions = permissions.filter(Q(end_date__isnull=True) | Q(end_date__gt=now))
-                    if permissions:
-                        for pp in permissions:
-                            self.authorities[pp.authority.code] = pp.authority.title
+                    self._set_authorities(permission_service.get_authority_snapshot(self.id))
                 except Exception as ee:
                     error_service.record(ee, f"Error retrieving permissions for {self.email}")
+            self._compile_authorities()
+
+    def _set_authorities(self, snapshot):
+        self.authority_codes = sorted(snapshot['authorities'])
+        self.authorities_expire = snapshot['expires']
+        self.permissions_version = snapshot.get('version')
+        self._compile_authorities()
+
+    def _compile_authorities(self):
+        """
+        Build the set of effective authorities used by has_authority checks
+        """
+        codes = {str(cc).lower() for cc in self.authority_codes} if self.authority_codes else set()
+        self.effective_authorities = frozenset(codes | DynamicRole.get_satisfied(codes))
 
     def _get_user_instance(self):
         if not self.user_instance:
@@ -197,43 +308,45 @@ class AuthUser:
         if not self.user_instance:
             return
 
-        # Get contact from User
+        # Get (or provision) contact for User
         log.trace()
-        try:
-            self.contact_instance = self.user_instance.contact
-        except:
-            self.contact_instance = None
-
-        # If no linked contact, search for existing one
-        if not self.contact_instance:
-            self.contact_instance = Contact.get(self.email)
-            # If found, update user to match Contact
-            if self.contact_instance:
-                self.user_instance.first_name = self.contact_instance.first_name
-                self.user_instance.last_name = self.contact_instance.last_name
-                self.user_instance.save()
-                self.contact_instance.user = self.user_instance
-                self.contact_instance.save()
-                # Refresh self with updated info
-                self._populate_from_user(get_related=False)
-                return
-    
-        # Create a new contact if needed
-        if not self.contact_instance:
-            # First and last are required, but may not exist in user object
-            placeholder = self.user_instance.username
-            if not placeholder:
-                placeholder = self.user_instance.email.split('@')[0] if self.user_instance.email else None
-            self.contact_instance = Contact()
-            self.contact_instance.user = self.user_instance
-            self.contact_instance.first_name = self.first_name if self.first_name else placeholder
-            self.contact_instance.last_name = self.last_name if self.last_name else placeholder
-            self.contact_instance.email = self.email
-            self.contact_instance.save()
-            return
+        linked = self.user_instance.first_name, self.user_instance.last_name
+        self.contact_instance = contact_service.create_contact_from_user(self.user_instance)
+
+        # If an existing contact was linked, refresh self with updated info
+        if linked != (self.user_instance.first_name, self.user_instance.last_name):
+            self._populate_from_user(get_related=False)
 
     def __str__(self):
         return f"{self.first_name} {self.last_name} <{self.email}>".strip()
 
     def __repr__(self):
         return str(self)
+
+
+def authority_keys(authority_list):
+    """
+    Convert an authority code, csv string, or list of codes into a tuple of effective-authority keys
+    """
+    if type(authority_list) in (list, tuple, set, frozenset):
+        return _authority_keys(tuple(authority_list))
+    return _authority_keys(authority_list)
+
+
+@lru_cache(maxsize=512)
+def _authority_keys(authority_list):
+    if type(authority_list) is not tuple:
+        if ',' in authority_list:
+            authority_list = utility_service.csv_to_list(authority_list)
+        else:
+            authority_list = [authority_list]
+
+    keys = []
+    for authority_code in authority_list:
+        if authority_code.startswith('~'):
+            name = DynamicRole.get_name(authority_code)
+            # Unknown dynamic roles are kept as-is so they never match
+            keys.append(f"~{name}" if name else authority_code.lower())
+        else:
+            keys.append(authority_code.lower())
+    return tuple(keys)
@@ -1,36 +1,112 @@
-contact_admin_roles = ['admin', 'contact_admin']
-security_admin_roles = ['admin', 'security_admin']
+from ..services import utility_service
+from .log import Log
 
-power_user_roles = ['security_admin', 'admin', 'developer']
-super_user_roles = ['developer']
+log = Log()
 
-impersonation_roles = ['developer']
-proxy_roles = ['admin', 'proxy']
+# Older role strings were matched by keyword (i.e. '~security' or '~super_user')
+legacy_keywords = {
+    'power': 'power_user',
+    'super': 'superuser',
+    'imperson': 'impersonate',
+    'contact': 'contact_admin',
+    'security': 'security_admin',
+    'proxy': 'proxy',
+}
 
 
 class DynamicRole:
+    """
+    Dynamic roles ('~role_name') are satisfied by any one of a list of authority codes.
 
-    @staticmethod
-    def get(role_string):
+    Roles are declared as {role_name: [authority_codes]}. The built-in roles are MJG_BASE_DYNAMIC_ROLES.
+    Plugins may add roles, or add codes to existing roles, with a <PLUGIN>_DYNAMIC_ROLES setting or _DEFAULTS
+    entry, and the project may do the same with settings.DYNAMIC_ROLES. All sources are merged.
+    The registry is compiled once (at AppConfig.ready) into hash lookups.
+    """
+
+    # {role_name: frozenset(authority_codes)}
+    registry = None
+
+    # {authority_code: frozenset(role_keys)}  i.e. {'admin': {'~power_user', '~proxy', ...}}
+    reverse_index = None
+
+    # {role_string: role_name}  i.e. {'~security': 'security_admin'}
+    resolved_names = None
+
+    @classmethod
+    def compile(cls):
+        roles = {}
+        # Built-in roles are always included, even if mjg_base is listed by its AppConfig path
+        sources = [
+            utility_service.get_plugin_setting('mjg_base', 'MJG_BASE_DYNAMIC_ROLES', {}),
+            utility_service.get_setting('DYNAMIC_ROLES', {}),
+        ]
+        for plugin in utility_service.get_setting('INSTALLED_APPS', []):
+            if plugin.lower().startswith("django"):
+                continue
+            setting_name = f"{plugin.upper().replace('-', '_')}_DYNAMIC_ROLES"
+            sources.append(utility_service.get_plugin_setting(plugin, setting_name, {}))
+
+        for source in sources:
+            for role_name, codes in (source or {}).items():
+                role_name = role_name.lstrip('~').lower()
+                roles.setdefault(role_name, set()).update([str(cc).lower() for cc in codes])
+
+        reverse_index = {}
+        for role_name, codes in roles.items():
+            for code in codes:
+                reverse_index.setdefault(code, set()).add(f"~{role_name}")
+
+        cls.registry = {kk: frozenset(vv) for kk, vv in roles.items()}
+        cls.reverse_index = {kk: frozenset(vv) for kk, vv in reverse_index.items()}
+        cls.resolved_names = {}
+        log.debug(f"Compiled {len(cls.registry)} dynamic roles")
+
+    @classmethod
+    def get(cls, role_string):
         if '~' not in role_string:
             return [role_string]
 
-        if 'power' in role_string:
-            return power_user_roles
+        name = cls.get_name(role_string)
+        return sorted(cls.registry.get(name, [])) if name else []
+
+    @classmethod
+    def get_name(cls, role_string):
+        """
+        Get the name of the dynamic role referenced by a role string (i.e. '~security' ==> 'security_admin')
+        Returns None if the string does not reference a known dynamic role
+        """
+        if cls.registry is None:
+            cls.compile()
+
+        if role_string in cls.resolved_names:
+            return cls.resolved_names[role_string]
+
+        name = None
+        if '~' in role_string:
+            name = role_string.lstrip('~').lower()
+            if name not in cls.registry:
+                name = None
+                for keyword, role_name in legacy_keywords.items():
+                    if keyword in role_string:
+                        name = role_name if role_name in cls.registry else None
+                        break
 
-        if 'super' in role_string:
-            return super_user_roles
+        cls.resolved_names[role_string] = name
+        return name
 
-        if 'imperson' in role_string:
-            return impersonation_roles
-        if 'contact' in role_string:
-            return contact_admin_roles
-        if 'security' in role_string:
-            return security_admin_roles
-        if 'proxy' in role_string:
-            return proxy_roles
+    @classmethod
+    def get_satisfied(cls, authority_codes):
+        """
+        Get the keys ('~<name>') of all dynamic roles satisfied by the given authority codes
+        """
+        if cls.reverse_index is None:
+            cls.compile()
 
-        return []
+        satisfied = set()
+        for code in authority_codes:
+            satisfied.update(cls.reverse_index.get(code, ()))
+        return satisfied
 
     def __init__(self):
         pass
@@ -1,44 +1,73 @@
 import logging
-import datetime
-from inspect import getframeinfo, stack
+import time
 import os
+import sys
+from contextvars import ContextVar
+from .timeline import current_timeline
 from io import StringIO
 from html.parser import HTMLParser
 
 
+# Open trace() spans for the current thread/task, as a tuple of (function_name, start_time)
+# A new tuple is set on every change, so tasks that copied the context never share a stack
+spans = ContextVar('mjg_log_spans', default=())
+
+# Oldest spans are discarded beyond this depth (i.e. when end() is never called)
+max_span_depth = 50
+
+
 class Log:
     logger = None
-    fn_times = None
 
     def __init__(self):
         self.logger = logging.getLogger('base')
-        self.fn_times = {}
-
-    def debug(self, msg, strip_html=False):
-        self.logger.debug(strip_tags(msg) if strip_html else msg)
 
-    def info(self, msg, strip_html=False):
-        self.logger.info(strip_tags(msg) if strip_html else msg)
-
-    def warn(self, msg, strip_html=False):
-        self.logger.warning(strip_tags(msg) if strip_html else msg)
-
-    def warning(self, msg, strip_html=False):
-        self.logger.warning(strip_tags(msg) if strip_html else msg)
-
-    def error(self, msg, trace_error=True, strip_html=False):
-        filename, line, function = self.get_caller_data()
+    def debug(self, msg, *args, strip_html=False):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            args, (strip_html,) = self.legacy_flags(args, strip_html)
+            self.logger.debug(self.get_message(msg, args, strip_html))
+
+    def info(self, msg, *args, strip_html=False):
+        if self.logger.isEnabledFor(logging.INFO):
+            args, (strip_html,) = self.legacy_flags(args, strip_html)
+            self.logger.info(self.get_message(msg, args, strip_html))
+
+    def warn(self, msg, *args, strip_html=False):
+        self.warning(msg, *args, strip_html=strip_html)
+
+    def warning(self, msg, *args, strip_html=False):
+        if self.logger.isEnabledFor(logging.WARNING):
+            args, (strip_html,) = self.legacy_flags(args, strip_html)
+            self.logger.warning(self.get_message(msg, args, strip_html))
+
+    def error(self, msg, *args, trace_error=True, strip_html=False):
+        if not self.logger.isEnabledFor(logging.ERROR):
+            return
+        args, (trace_error, strip_html) = self.legacy_flags(args, trace_error, strip_html)
+        msg = self.get_message(msg, args, strip_html)
         if trace_error:
-            self.logger.error(f"{strip_tags(msg) if strip_html else msg} -- encountered in function {function}() at {filename}:{line}")
+            filename, line, function = self.get_caller_data()
+            self.logger.error(f"{msg} -- encountered in function {function}() at {filename}:{line}")
         else:
-            self.logger.error(f"{strip_tags(msg) if strip_html else msg}")
+            self.logger.error(msg)
 
     def trace(self, parameters=None, function_name=None):
+        # Tracing is only logged at DEBUG level. Skip all work if it would be discarded (and not timed)
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        if not (debug or self.timing_spans()):
+            return
+
         # If function name not specified, get it from the stack
         if function_name is None:
             function_name = self.get_calling_function()
 
-        self.fn_times[function_name] = {'start': datetime.datetime.now()}
+        self.start_span(function_name)
+        if not debug:
+            return
+
+        # Parameters may be given as a function, to only be evaluated when logged
+        if callable(parameters):
+            parameters = parameters()
 
         if type(parameters) is dict:
             ll = [f"{kk}='{vv}'" for kk, vv in parameters.items()]
@@ -51,18 +80,26 @@ class Log:
             del params
 
     def end(self, result=None, function_name=None):
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        timeline = self.timing_spans()
+        if not (debug or timeline):
+            return result
+
         # If function name not specified, get it from the stack
         if function_name is None:
             function_name = self.get_calling_function()
 
         # If start time is known, log a completion time
         metric_txt_add_on = ""
-        if function_name in self.fn_times and 'start' in self.fn_times[function_name]:
-            self.fn_times[function_name]['stop'] = datetime.datetime.now()
-            delta = self.fn_times[function_name]['stop'] - self.fn_times[function_name]['start']
-            duration = str(int(delta.total_seconds() * 1000))
-            metric_txt_add_on = f"-- completed in {duration} ms"
-            del self.fn_times[function_name]
+        start = self.end_span(function_name)
+        if start is not None:
+            elapsed = (time.perf_counter() - start) * 1000
+            if timeline is not None:
+                timeline.add(function_name, elapsed)
+            metric_txt_add_on = f"-- completed in {int(elapsed)} ms"
+
+        if not debug:
+            return result
 
         # Only log a return value if a result was provided
         if result is not None:
@@ -75,6 +112,9 @@ class Log:
         return result
 
     def summary(self, result=None, parameters=None):
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+
         # Get function name from the stack
         function_name = self.get_calling_function()
 
@@ -82,14 +122,84 @@ class Log:
         return_txt = ""
         if result is not None:
             return_txt = f" ==> {str(result)}"
-        param_txt = self.get_param_string(parameters)
+        param_txt = self.get_param_string(parameters() if callable(parameters) else parameters)
         self.logger.debug(f"TRACED: {function_name}({param_txt}) {return_txt}")
 
+    @staticmethod
+    def timing_spans():
+        """
+        Get the current request's timeline, if it is recording spans
+        """
+        timeline = current_timeline.get()
+        return timeline if timeline is not None and timeline.include_spans else None
+
+    @staticmethod
+    def start_span(function_name):
+        stack = spans.get()
+        if len(stack) >= max_span_depth:
+            stack = stack[1 - max_span_depth:]
+        spans.set(stack + ((function_name, time.perf_counter()),))
+
+    @staticmethod
+    def end_span(function_name):
+        """
+        Close the most recent span for the given function. Returns its start time, or None if not found.
+        Spans opened after it (inner functions that never called end()) are closed with it.
+        """
+        stack = spans.get()
+        for ii in range(len(stack) - 1, -1, -1):
+            if stack[ii][0] == function_name:
+                spans.set(stack[:ii])
+                return stack[ii][1]
+        return None
+
+    @staticmethod
+    def clear_spans():
+        """
+        Discard all open spans (i.e. at the start of a request, on a re-used thread)
+        """
+        spans.set(())
+
     def get_calling_function(self):
         filename, line, function = self.get_caller_data()
         file_basename = os.path.splitext(os.path.basename(filename))[0]
         return f"{file_basename}.{function}"
 
+    @staticmethod
+    def legacy_flags(args, *flags):
+        """
+        Before message args were accepted, flags were given positionally: debug(msg, strip_html) and
+        error(msg, trace_error, strip_html). Only-bool args are still treated as those flags.
+        Returns (message_args, flags)
+        """
+        if args and len(args) <= len(flags) and all(type(aa) is bool for aa in args):
+            return (), tuple(args) + flags[len(args):]
+        return args, flags
+
+    @staticmethod
+    def get_message(msg, args=None, strip_html=False):
+        """
+        Build a log message. Only called once the message is known to be logged, so that it may be lazy:
+            log.debug("Loaded %s rows", len(rows))
+            log.debug(lambda: f"Parameters: {expensive_lookup()}")
+        """
+        if callable(msg):
+            msg = msg()
+        if args:
+            msg = Log._format_args(msg, args)
+        return strip_tags(str(msg)) if strip_html else msg
+
+    @staticmethod
+    def _format_args(msg, args):
+        # %-style formatting only applies to a message that has placeholders for the args
+        if type(msg) is str and '%' in msg:
+            try:
+                return msg % args
+            except (TypeError, ValueError):
+                pass
+        # Otherwise (i.e. legacy log.error(ee, "description") calls), log all given values
+        return " ".join(str(xx) for xx in (msg,) + tuple(args))
+
     @staticmethod
     def get_param_string(parameters=None):
 
@@ -107,21 +217,17 @@ class Log:
     def get_caller_data(include_full_path=False):
         """Return the calling code as (file-name, line-number, function-name)"""
 
-        # Ignore this function, and the Log.<function> that called it
-        depth = 3
-
-        # Get the info about the function that called the log wrapper
-        caller = getframeinfo(stack()[depth][0])
-
-        # In case of nested functions within this class, may need to look deeper
-        while caller.filename.endswith('Log.py'):
-            depth += 1
-            caller = getframeinfo(stack()[depth][0])
+        # Walk out of this file to the code that called the Log.<function>
+        # (sys._getframe does not build the whole stack or read source files, like inspect.stack() does)
+        frame = sys._getframe(1)
+        while frame.f_back and frame.f_code.co_filename == __file__:
+            frame = frame.f_back
 
+        filename = frame.f_code.co_filename
         return (
-            caller.filename if include_full_path else os.path.basename(caller.filename),
-            caller.lineno,
-            caller.function
+            filename if include_full_path else os.path.basename(filename),
+            frame.f_lineno,
+            frame.f_code.co_name
         )
 
 
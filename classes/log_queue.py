@@ -0,0 +1,211 @@
+import logging
+import logging.handlers
+import queue
+import threading
+import atexit
+
+# Overflow policies (LOG_QUEUE_OVERFLOW setting)
+drop_new = 'drop_new'          # Discard the record being logged
+drop_oldest = 'drop_oldest'    # Discard the oldest queued record to make room
+block = 'block'                # Wait for room (request threads may stall on slow handlers)
+
+# How long to wait for room in a full queue when stopping at exit
+shutdown_seconds = 5
+
+# Listeners started by install(), as {logger_name: QueueListener}
+listeners = {}
+_install_lock = threading.Lock()
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a QueueListener thread. When the (bounded) queue is full, the overflow policy applies,
+    and the number of dropped records is reported in a warning once the queue has room again.
+    """
+    overflow = drop_new
+    dropped = 0
+
+    def __init__(self, log_queue, overflow=drop_new):
+        super().__init__(log_queue)
+        self.overflow = overflow
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The queue never leaves this process, so the record does not need to be copied and made picklable.
+        # Only resolve the message now, in case its arguments change before the listener formats it
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        if self.overflow == block:
+            self.queue.put(record)
+            return
+
+        # Request threads share this handler, so the dropped count is only read and updated under its lock
+        # (the queue operations below never block)
+        with self.lock:
+            if self.dropped:
+                self._report_dropped()
+
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                pass
+
+            if self.overflow == drop_oldest:
+                try:
+                    self.queue.get_nowait()
+                    self.queue.put_nowait(record)
+                except (queue.Empty, queue.Full):
+                    pass
+            self.dropped += 1
+
+    def _report_dropped(self):
+        # Called with self.lock held
+        record = logging.LogRecord(
+            'base', logging.WARNING, __file__, 0, f"Log queue was full. Dropped {self.dropped} log records.", None, None
+        )
+        try:
+            self.queue.put_nowait(record)
+            self.dropped = 0
+        except queue.Full:
+            pass
+
+
+class BatchingFileHandler(logging.FileHandler):
+    """
+    File handler that writes records in batches, rather than one write (and flush) per record.
+    Intended to run on a QueueListener thread, which flushes it whenever the queue is idle.
+    """
+    batch_size = 100
+    buffer = None
+
+    def __init__(self, filename, batch_size=100, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.batch_size = batch_size
+        self.buffer = []
+
+    def emit(self, record):
+        try:
+            self.buffer.append(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.buffer:
+                if self.stream is None:
+                    self.stream = self._open()
+                self.stream.write(''.join(self.buffer))
+                self.buffer = []
+            if self.stream and hasattr(self.stream, "flush"):
+                self.stream.flush()
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """
+    QueueListener that flushes its handlers whenever the queue has been idle for flush_seconds
+    """
+    flush_seconds = 1
+
+    def __init__(self, log_queue, *handlers, flush_seconds=1):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.flush_seconds = flush_seconds
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, timeout=self.flush_seconds if block else None)
+            except queue.Empty:
+                if not block:
+                    raise
+                for handler in self.handlers:
+                    handler.flush()
+
+    def enqueue_sentinel(self):
+        # The queue may be full at shutdown. Give the listener time to make room, then discard queued records
+        try:
+            self.queue.put(self._sentinel, timeout=shutdown_seconds)
+            return
+        except queue.Full:
+            pass
+        while True:
+            try:
+                self.queue.put_nowait(self._sentinel)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def stop(self):
+        # May be stopped explicitly, and again at exit
+        if self._thread is None:
+            return
+        super().stop()
+        for handler in self.handlers:
+            handler.flush()
+
+
+def install(logger_name, queue_size=10000, overflow=drop_new, filename=None, batch_size=100, flush_seconds=1):
+    """
+    Move a logger's handlers behind a bounded queue, so that log I/O happens on a background thread.
+    Handlers of ancestor loggers (i.e. root) that the logger propagates to are called by the listener too,
+    and the logger stops propagating, so no handler runs on the request thread.
+    If a filename is given, records are also written to that file in batches.
+    Returns the QueueListener, or None if there is nothing to move off the request path (no handlers, or
+    records already go straight to a queue, i.e. by propagating to a logger that was installed already)
+    """
+    with _install_lock:
+        if logger_name in listeners:
+            return listeners[logger_name]
+
+        logger = logging.getLogger(logger_name)
+        handlers = _get_effective_handlers(logger)
+        if not filename and all(isinstance(hh, logging.handlers.QueueHandler) for hh in handlers):
+            return None
+        if filename:
+            file_handler = BatchingFileHandler(filename, batch_size=batch_size)
+            file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+            handlers.append(file_handler)
+
+        log_queue = queue.Queue(maxsize=queue_size)
+        listener = BatchingQueueListener(log_queue, *handlers, flush_seconds=flush_seconds)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.addHandler(BoundedQueueHandler(log_queue, overflow))
+
+        # Ancestors' handlers are now called by the listener (they remain in place for other loggers)
+        logger.propagate = False
+
+        listener.start()
+        atexit.register(listener.stop)
+        listeners[logger_name] = listener
+        return listener
+
+
+def _get_effective_handlers(logger):
+    """
+    Get the handlers a record logged to this logger would reach: its own, and those of the ancestors it propagates to
+    """
+    handlers = []
+    current = logger
+    while current:
+        handlers.extend([hh for hh in current.handlers if hh not in handlers])
+        if not current.propagate:
+            break
+        current = current.parent
+    return handlers
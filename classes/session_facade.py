@@ -0,0 +1,152 @@
+from .log import Log
+import json
+import threading
+
+log = Log()
+
+# Marks a session variable that does not exist (None is a valid session value)
+missing = object()
+
+# Process-wide session usage statistics (see SessionFacade.get_stats)
+_stats_lock = threading.Lock()
+_stats = {'requests': 0, 'saves': 0, 'var_bytes': {}}
+
+
+class SessionFacade:
+    """
+    Buffers prefixed session variables for the duration of a request.
+
+    Reads are cached, and writes are held until flush() is called at the end of the request.
+    Only variables whose (serialized) value actually changed are written back to the session, so
+    the session is only marked as modified when something really changed. This also catches
+    in-place changes to mutable values, such as appending to a list that was read from the session.
+
+    If the session is flushed or cycled during the request (i.e. logout), values buffered before that are
+    dropped, so they never leak into the new session.
+    """
+    session = None
+    values = None
+    originals = None
+
+    # The session key and data the buffered values belong to
+    session_key = None
+    session_data = None
+
+    def get(self, var, alt=None):
+        self._check_session()
+        if var not in self.values:
+            value = self.session.get(var, missing)
+            self.originals[var] = self._serialize(value)
+            self.values[var] = value
+            if self.session_data is None:
+                self.session_data = getattr(self.session, '_session_cache', None)
+
+        value = self.values[var]
+        return alt if value is missing else value
+
+    def set(self, var, val):
+        self._check_session()
+        # Remember the original value, so it can be compared when flushing
+        if var not in self.originals:
+            self.get(var)
+        self.values[var] = val
+        return val
+
+    def delete(self, var):
+        self.set(var, missing)
+
+    def reset(self, preserve=None):
+        """
+        Forget buffered values (i.e. after session variables were removed directly), except those in preserve
+        """
+        keep = [var for var in (preserve or []) if var in self.values]
+        self.values = {var: self.values[var] for var in keep}
+        self.originals = {var: self.originals[var] for var in keep}
+        self.session_key = self.session.session_key
+        self.session_data = None
+
+    def flush(self):
+        """
+        Write changed variables to the session.
+        Returns the number of variables written.
+        """
+        self._check_session()
+        written = {}
+        for var, value in self.values.items():
+            serialized = self._serialize(value)
+            if serialized == self.originals[var]:
+                continue
+
+            if value is missing:
+                self.session.pop(var, None)
+            else:
+                self.session[var] = value
+            written[var] = len(serialized.encode()) if type(serialized) is str else 0
+            self.originals[var] = serialized
+
+        self._record_stats(written)
+        return len(written)
+
+    @staticmethod
+    def get_stats():
+        """
+        Session usage since the server started:
+            requests:       Number of requests that used prefixed session variables
+            saves:          Number of those requests that needed to write to the session
+            prefix_bytes:   Most recently written size (bytes) of variables, grouped by name prefix
+        """
+        with _stats_lock:
+            prefix_bytes = {}
+            for var, size in _stats['var_bytes'].items():
+                prefix = SessionFacade._get_prefix(var)
+                prefix_bytes[prefix] = prefix_bytes.get(prefix, 0) + size
+            return {
+                'requests': _stats['requests'],
+                'saves': _stats['saves'],
+                'prefix_bytes': dict(sorted(prefix_bytes.items(), key=lambda i: -i[1])),
+            }
+
+    def _check_session(self):
+        """
+        Drop buffered values if the session was flushed or cycled since they were buffered
+        """
+        # A cycled session has a new key (a new session being saved for the first time does not count).
+        # A flushed session has new (empty) data, and no key.
+        data = getattr(self.session, '_session_cache', None)
+        key_changed = self.session_key is not None and self.session.session_key != self.session_key
+        if key_changed or (self.session_data is not None and data is not self.session_data):
+            if self.values:
+                log.debug("Session was flushed or cycled. Dropping buffered session variables.")
+            self.reset()
+        elif self.session_key is None:
+            self.session_key = self.session.session_key
+
+    @staticmethod
+    def _serialize(value):
+        if value is missing:
+            return None
+        try:
+            return json.dumps(value, sort_keys=True, default=str)
+        except Exception:
+            # Cannot compare. Assume it has changed.
+            return object()
+
+    @staticmethod
+    def _get_prefix(var):
+        # i.e. 'demo~cache-views-user_list-sort' ==> 'demo~cache-views-user_list'
+        return var.rsplit('-', 1)[0]
+
+    def _record_stats(self, written):
+        with _stats_lock:
+            _stats['requests'] += 1
+            if written:
+                _stats['saves'] += 1
+            _stats['var_bytes'].update(written)
+
+        if written:
+            log.debug(f"Session variables written: {', '.join(written.keys())}")
+
+    def __init__(self, session):
+        self.session = session
+        self.values = {}
+        self.reset()
@@ -0,0 +1,45 @@
+from django.conf import settings
+
+
+class SettingsSnapshot:
+    """
+    Read-only copy of the settings that are checked on every request (environment, debug, etc).
+
+    Built once at AppConfig.ready so hot-path checks like is_production() are plain attribute reads.
+    When a test overrides one of the source_settings, the setting_changed signal rebuilds the snapshot.
+    """
+    __slots__ = (
+        'environment', 'is_production', 'is_non_production', 'is_development',
+        'debug', 'app_code', 'app_name', 'posted_message_position',
+    )
+
+    # Settings the snapshot is built from
+    source_settings = frozenset({'ENVIRONMENT', 'DEBUG', 'APP_CODE', 'APP_NAME', 'POSTED_MESSAGE_POSITION'})
+
+    def __init__(self):
+        env = str(getattr(settings, 'ENVIRONMENT', 'DEV')).upper()
+        if env not in ['DEV', 'STAGE', 'PROD']:
+            env = 'DEV'
+        debug = bool(getattr(settings, 'DEBUG', False))
+
+        values = {
+            'environment': env,
+            'is_production': env == 'PROD',
+            'is_non_production': env != 'PROD',
+            'is_development': env == 'DEV' and debug,
+            'debug': debug,
+            'app_code': getattr(settings, 'APP_CODE', None),
+            'app_name': getattr(settings, 'APP_NAME', None),
+            'posted_message_position': str(getattr(settings, 'POSTED_MESSAGE_POSITION', 'TOP')).upper(),
+        }
+        for key, value in values.items():
+            object.__setattr__(self, key, value)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("SettingsSnapshot is read-only")
+
+    def __delattr__(self, key):
+        raise AttributeError("SettingsSnapshot is read-only")
+
+    def __repr__(self):
+        return f"<SettingsSnapshot {self.environment} debug={self.debug}>"
@@ -0,0 +1,102 @@
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+import re
+import time
+
+# Timeline for the current request (set by MjgBaseMiddleware)
+current_timeline = ContextVar('mjg_timeline', default=None)
+
+# Limit on distinct phases/spans recorded per request (bounds header size and memory)
+max_phases = 40
+
+# Server-Timing metric names must be HTTP tokens
+_invalid_metric_chars = re.compile(r"[^A-Za-z0-9!#$%&'*+.^_`|~-]")
+
+
+class Timeline:
+    """
+    Durations (ms) of the phases of a single request, in the order they were first recorded.
+
+    Phases are recorded by the middleware (auth, xss, flash, view, render, etc). When include_spans
+    is True, Log.trace/Log.end spans are recorded too. Repeated phases/spans are summed.
+    """
+    started = None
+    phases = None
+    include_spans = False
+
+    # Phases that have been started but not yet stopped, as {name: start_time}
+    open_phases = None
+
+    def __init__(self, include_spans=False):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.open_phases = {}
+        self.include_spans = include_spans
+
+    @classmethod
+    def begin(cls, include_spans=False):
+        """
+        Start a timeline for the current request. Returns (timeline, token). Pass the token to finish()
+        """
+        timeline = cls(include_spans)
+        return timeline, current_timeline.set(timeline)
+
+    @staticmethod
+    def finish(token):
+        current_timeline.reset(token)
+
+    @staticmethod
+    def get():
+        return current_timeline.get()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def start(self, name):
+        """
+        Start a phase that ends somewhere else (i.e. template rendering). Only the first start counts.
+        """
+        self.open_phases.setdefault(name, time.perf_counter())
+
+    def stop(self, name):
+        start = self.open_phases.pop(name, None)
+        if start is not None:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add(self, name, duration):
+        if name in self.phases:
+            self.phases[name] += duration
+        elif len(self.phases) < max_phases:
+            self.phases[name] = duration
+
+    def total(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self):
+        """
+        Format as a Server-Timing header value (i.e. 'auth;dur=1.2, view;dur=35.0, total;dur=40.1')
+        """
+        metrics = [f"{_invalid_metric_chars.sub('_', name)};dur={duration:.1f}" for name, duration in self.phases.items()]
+        metrics.append(f"total;dur={self.total():.1f}")
+        return ", ".join(metrics)
+
+    def to_dict(self):
+        return {
+            'total': round(self.total(), 3),
+            'phases': {name: round(duration, 3) for name, duration in self.phases.items()},
+        }
+
+
+def phase(name):
+    """
+    Time a block as a phase of the current request's timeline (does nothing outside a request)
+        with timeline.phase('auth'):
+            ...
+    """
+    timeline = current_timeline.get()
+    return timeline.phase(name) if timeline is not None else nullcontext()
@@ -1,17 +1,27 @@
 from .services import utility_service, auth_service
 from .classes.log import Log
 from .classes.breadcrumb import Breadcrumb
-from django.conf import settings
+from .classes.admin_link import AdminLink
+from .classes.timeline import Timeline
+from django.utils.functional import SimpleLazyObject
 
 log = Log()
 
 
 def util(request):
+    # Template rendering starts here (first context processor), and ends with the view
+    timeline = Timeline.get()
+    if timeline is not None:
+        timeline.start('render')
+
     # Build an absolute URL (for use in emails)
     absolute_root_url = "{0}://{1}".format(request.scheme, request.get_host())
     if 'http://' in absolute_root_url and 'localhost' not in absolute_root_url:
         absolute_root_url = absolute_root_url.replace('http://', 'https://')
 
+    config = utility_service.get_settings_snapshot()
+    installed_plugins = utility_service.get_installed_plugins()
+
     breadcrumbs = []
     for bc in utility_service.get_breadcrumbs():
         breadcrumbs.append(Breadcrumb(bc))
@@ -21,41 +31,22 @@ def util(request):
 
         # The home URL (path) depends on existence of URL Context
         'home_url': '/',
-        'mjg_plugins': utility_service.get_installed_plugins(),
+        'mjg_plugins': installed_plugins,
 
         # Prod vs Nonprod
-        'is_production': utility_service.is_production(),
-        'is_non_production': utility_service.is_non_production(),
-        'is_development': utility_service.is_development(),
+        'is_production': config.is_production,
+        'is_non_production': config.is_non_production,
+        'is_development': config.is_development,
 
         # Breadcrumbs (can be set in the view with utility_service functions)
         'breadcrumbs': breadcrumbs,
 
         # Posted messages at top of page by default. Setting option allows moving them to the bottom
-        'posted_message_position': getattr(settings, 'POSTED_MESSAGE_POSITION', 'TOP').upper()
+        'posted_message_position': config.posted_message_position
     }
 
-    # Get admin links for any installed MJG plugins, and the current app
-    plugin_admin_links = []
-    apps = utility_service.get_installed_plugins()
-    apps.update({utility_service.get_app_code().lower(): utility_service.get_app_version()})
-    for plugin, version in apps.items():
-        if plugin.lower().startswith("django"):
-            continue
-        setting_name = f"{plugin.upper().replace('-', '_')}_ADMIN_LINKS"
-        try:
-            this_link_list = getattr(settings, setting_name)
-            plugin_admin_links.extend(this_link_list)
-        except AttributeError as ee:
-            try:
-                exec(f"from {plugin} import _DEFAULTS as {plugin}_defaults")
-                these_links = eval(f"{plugin}_defaults['{setting_name}']")
-                if these_links:
-                    plugin_admin_links.extend(these_links)
-            except Exception as ee:
-                pass
-
-    model['plugin_admin_links'] = sorted(plugin_admin_links, key=lambda i: i['label'])
+    # Admin links for any installed MJG plugins, and the current app (compiled at startup)
+    model['plugin_admin_links'] = AdminLink.get_registry()
     return model
 
 
@@ -71,5 +62,6 @@ def auth(request):
         'is_impersonating': auth_instance.is_impersonating(),
         'can_proxy': auth_instance.get_user().has_authority('~proxy'),
         'is_proxying': auth_instance.is_proxying(),
-        'avatar_url': auth_service.get_avatar_url(),
+        # Only looked up if the avatar is displayed, and then only once per render
+        'avatar_url': SimpleLazyObject(auth_service.get_avatar_url),
     }
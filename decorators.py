@@ -14,12 +14,13 @@ log = Log()
 # ===                                ===
 
 
-def require_authority(authority_code, redirect_url='/'):
+def require_authority(authority_code, redirect_url='/', require_all=False):
     """
     Decorator for views that checks that the user has the required authority.
 
     authority_code: An authority_code, or a list of authority codes
     redirect_url: Where to send unauthorized user
+    require_all: If True, user must have every authority in the list (rather than any one of them)
 
     Example:
         from mjg_base.decorators import require_authority
@@ -39,7 +40,9 @@ def require_authority(authority_code, redirect_url='/'):
                 return decorator_sso_redirect(request)
 
             # If has authority, render the view
-            elif auth_service.has_authority(authority_code):
+            elif require_all and auth_service.has_all_authorities(authority_code):
+                return view_func(request, *args, **kwargs)
+            elif (not require_all) and auth_service.has_any_authority(authority_code):
                 return view_func(request, *args, **kwargs)
 
             # Otherwise, send somewhere else
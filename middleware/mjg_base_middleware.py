@@ -1,14 +1,41 @@
 from django.shortcuts import redirect
 from ..services import utility_service, auth_service
 from ..classes.log import Log
+from ..classes.timeline import Timeline
 from django.urls import reverse
+from asgiref.sync import sync_to_async
+try:
+    from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+except ImportError:
+    # asgiref < 3.6 (i.e. Django 3.2): mark coroutine functions the way asyncio recognizes them
+    from asyncio import iscoroutinefunction, coroutines
+
+    def markcoroutinefunction(func):
+        func._is_coroutine = coroutines._is_coroutine
+        return func
+import logging
+import json
+import time
 
 log = Log()
 
+# Makes the start of a new request more visible in the log (console)
+banner_width = 80
+new_request_banner = f"\n{'=' * banner_width}\n{'New Request'.center(banner_width)}\n{'=' * banner_width}"
+
+# Request timelines are written here (as JSON lines) when the TIMELINE_FILE setting is given
+timeline_logger = logging.getLogger('base.timeline')
+
 
 class MjgBaseMiddleware:
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        # Run asynchronously when the rest of the middleware chain is async (ASGI)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
         # One-time configuration and initialization.
         log.debug("Using MJG Base")
 
@@ -20,6 +47,43 @@ class MjgBaseMiddleware:
         return None
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        token = utility_service.set_request(request)
+        timeline, timeline_token = Timeline.begin(utility_service.get_setting('TIMELINE_SPANS'))
+        try:
+            silence_logs = self.before_view(request)
+            response = self.get_response(request)
+            self.after_view(request, response, silence_logs)
+        finally:
+            Timeline.finish(timeline_token)
+            utility_service.reset_request(token)
+        return response
+
+    async def __acall__(self, request):
+        token = utility_service.set_request(request)
+        timeline, timeline_token = Timeline.begin(utility_service.get_setting('TIMELINE_SPANS'))
+        try:
+            # Session and database access must not run in the event loop
+            silence_logs = await sync_to_async(self.before_view)(request)
+            response = await self.get_response(request)
+            await sync_to_async(self.after_view)(request, response, silence_logs)
+        finally:
+            Timeline.finish(timeline_token)
+            utility_service.reset_request(token)
+        return response
+
+    def before_view(self, request):
+        """
+        Prepare for the view. Returns True if logging should be silenced for this request.
+        """
+        timeline = Timeline.get()
+
+        # Page scope only lasts for one request. Make sure nothing remains from a previous request on this thread.
+        utility_service.clear_page_scope()
+        log.clear_spans()
+
         # Is this an AWS health check or posted messages?
         posted_messages = request.path == reverse('base:messages')
         silence_logs = utility_service.is_health_check() or posted_messages
@@ -30,39 +94,65 @@ class MjgBaseMiddleware:
         # In non-prod, make the start of a new request more visible in the log (console)
         if not silence_logs:
             if utility_service.is_non_production():
-                w = 80
-                log.debug(f"\n{'='.ljust(w, '=')}\n{'New Request'.center(w)}\n{'='.ljust(w, '=')}")
-            log.trace([request.path, auth_service.get_user()], request.method)
+                log.debug(new_request_banner)
+            with timeline.phase('auth'):
+                user = auth_service.get_user()
+            log.trace([request.path, user], request.method)
             if auth_service.has_authority('~power_user'):
                 utility_service.set_session_var('allow_limited_features', True)
 
             # ToDo: Remove debug logging
             if request.path.startswith('/accounts'):
                 if request.method == 'POST' and 'email' in request.POST:
-                    log.info(f"Login Email: {request.POST.get('email')}")
+                    log.info("Login Email: %s", request.POST.get('email'))
                 elif request.method == 'GET' and 'email' in request.GET:
-                    log.info(f"Login Email: {request.GET.get('email')}")
+                    log.info("Login Email: %s", request.GET.get('email'))
                 elif request.method == 'GET' and 'authuser' in request.GET:
-                    log.info(f"Auth User: {request.GET.get('authuser')}")
+                    log.info("Auth User: %s", request.GET.get('authuser'))
                 else:
                     log.debug(request.POST)
                     log.debug(request.GET)
             elif utility_service.is_non_production():
                 if request.method == "POST":
-                    log.debug(f"Parameters: { {k:v for k,v in request.POST.items() if k != 'csrfmiddlewaretoken'} }")
+                    log.debug(lambda: f"Parameters: { {k:v for k,v in request.POST.items() if k != 'csrfmiddlewaretoken'} }")
 
         # Remove flash variables from two requests ago. Shift flash variables from last request.
         # This happens for every request EXCEPT posting messages to the screen
         if not posted_messages:
-            utility_service.cycle_flash_scope()
+            with timeline.phase('flash'):
+                utility_service.cycle_flash_scope()
 
-        # Render the response
-        response = self.get_response(request)
+        return silence_logs
 
-        # After the view has completed
-        utility_service.clear_page_scope()
+    def after_view(self, request, response, silence_logs):
+        timeline = Timeline.get()
+
+        # Rendering was started by the util context processor, and ends with the view
+        timeline.stop('render')
+
+        # After the view has completed, write any changed session variables in one go
+        with timeline.phase('session'):
+            utility_service.flush_session_vars()
+        with timeline.phase('clear_page_scope'):
+            utility_service.clear_page_scope()
 
         if not silence_logs:
             log.end(None, request.path)
+            self.report_timeline(request, response, timeline)
 
-        return response
+    @staticmethod
+    def report_timeline(request, response, timeline):
+        # Developers can see the timeline in the browser's developer tools
+        if auth_service.has_authority(utility_service.get_setting('TIMELINE_AUTHORITIES')):
+            response['Server-Timing'] = timeline.server_timing()
+
+        # Timelines may be collected for offline latency analysis
+        if utility_service.get_setting('TIMELINE_FILE'):
+            record = {
+                'time': round(time.time(), 3),
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+            }
+            record.update(timeline.to_dict())
+            timeline_logger.info(json.dumps(record))
@@ -1,13 +1,22 @@
 from django.shortcuts import redirect
 from ..services import utility_service, message_service, validation_service, auth_service
 from ..classes.log import Log
+from ..classes import timeline
 from ..models.utility.xss_attempt import XssAttempt
 from django.urls import reverse
 from django.http import HttpResponseForbidden, HttpResponse
+from django.utils.decorators import sync_and_async_middleware
+from asgiref.sync import sync_to_async
+try:
+    from asgiref.sync import iscoroutinefunction
+except ImportError:
+    # asgiref < 3.6 (i.e. Django 3.2)
+    from asyncio import iscoroutinefunction
 
 log = Log()
 
 
+@sync_and_async_middleware
 def xss_prevention(get_response):
     def script_response(param, value, is_ajax, path):
 
@@ -38,8 +47,10 @@ def xss_prevention(get_response):
         else:
             return redirect('base:xss_block')
 
-    def xss_middleware(request):
-
+    def check_request(request):
+        """
+        Returns a response if the request should be blocked, otherwise None
+        """
         # Gather conditions and values used later
         is_ajax = utility_service.is_ajax()
         is_terminating_impersonation = request.path == reverse('base:stop_impersonating')
@@ -81,17 +92,46 @@ def xss_prevention(get_response):
                 if attempts >= 3:
                     return redirect('base:xss_lock')
 
-        # Otherwise, continue normally (and add XSS-Protection header)
-        response = get_response(request)
+        return None
+
+    def add_security_headers(response):
+        # Add XSS-Protection header
         if type(response) is HttpResponse:
             response['X-XSS-Protection'] = "1"
 
             # Also add Cache-control: no-store and Pragma: no-cache headers (recommended by security team)
-            response['Cache-Control'] = "no-store"
-            response['Pragma'] = "no-cache"
+            # Only content-addressed responses (i.e. Gravatar images) are exempt, since their content never changes
+            if not getattr(response, 'content_addressed', False):
+                response['Cache-Control'] = "no-store"
+                response['Pragma'] = "no-cache"
         else:
             log.info(f"Security headers not added to {type(response)}")
 
         return response
 
+    if iscoroutinefunction(get_response):
+        async def xss_middleware(request):
+            # Session and database access must not run in the event loop
+            with timeline.phase('xss'):
+                blocked_response = await sync_to_async(check_request)(request)
+            if blocked_response is not None:
+                return blocked_response
+
+            # Otherwise, continue normally
+            with timeline.phase('view'):
+                response = await get_response(request)
+            return add_security_headers(response)
+
+    else:
+        def xss_middleware(request):
+            with timeline.phase('xss'):
+                blocked_response = check_request(request)
+            if blocked_response is not None:
+                return blocked_response
+
+            # Otherwise, continue normally
+            with timeline.phase('view'):
+                response = get_response(request)
+            return add_security_headers(response)
+
     return xss_middleware
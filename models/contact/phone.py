@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import Q, F, Case, When, Value, CharField
+from django.db.models.functions import Concat, Substr
 from mjg_base.classes.log import Log
 from mjg_base.services import utility_service, message_service, error_service
 from mjg_base.models.contact.contact import Contact
@@ -8,6 +10,32 @@ from mjg_base.services import validation_service
 log = Log()
 
 
+class PhoneQuerySet(models.QuerySet):
+    def with_formatted_numbers(self):
+        """
+        Annotate each phone with its formatted number (formatted_phone_number), so that listing many
+        phones does not format each one in Python. Only standard 10-digit numbers are formatted by the
+        database. Others are annotated as None, and formatted_number() formats them as usual.
+        """
+        prefix = Case(
+            When(Q(prefix__isnull=False) & ~Q(prefix__in=['', '1']), then=Concat(F('prefix'), Value(' - '))),
+            default=Value(''), output_field=CharField()
+        )
+        extension = Case(
+            When(Q(extension__isnull=False) & ~Q(extension=''), then=Concat(Value(' ext '), F('extension'))),
+            default=Value(''), output_field=CharField()
+        )
+        number = Concat(
+            Value('('), Substr('phone_number', 1, 3), Value(') '),
+            Substr('phone_number', 4, 3), Value('-'), Substr('phone_number', 7, 4),
+            output_field=CharField()
+        )
+        return self.annotate(formatted_phone_number=Case(
+            When(phone_number__regex=r'^[0-9]{10}$', then=Concat(prefix, number, extension, output_field=CharField())),
+            default=None, output_field=CharField()
+        ))
+
+
 class Phone(models.Model):
     """
     Telephone numbers associated with a Contact
@@ -27,6 +55,8 @@ class Phone(models.Model):
     extension = models.CharField(max_length=10, blank=True, null=True)
     prefix = models.CharField(max_length=5, blank=True, null=True)
 
+    objects = PhoneQuerySet.as_manager()
+
     def set_ptype(self, ptype):
         if ptype in self.phone_types():
             self.ptype = ptype
@@ -79,6 +109,10 @@ class Phone(models.Model):
             return False
 
     def formatted_number(self):
+        # Pre-formatted by PhoneQuerySet.with_formatted_numbers()
+        if getattr(self, 'formatted_phone_number', None):
+            return self.formatted_phone_number
+
         pn = utility_service.format_phone(self.phone_number)
         if self.prefix and self.prefix != '1':
             pn = f"{self.prefix} - {pn}"
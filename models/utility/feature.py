@@ -113,10 +113,13 @@ class Feature(models.Model):
         """
         Get a map of features and whether or not they are enabled
         """
-        toggles = utility_service.recall()
-        if toggles and not force_query:
-            return toggles
+        if force_query:
+            cls._get_feature_toggles.clear_request_cache()
+        return cls._get_feature_toggles()
 
+    @classmethod
+    @utility_service.request_cached
+    def _get_feature_toggles(cls):
         log.trace()
         toggles = {}
 
@@ -130,7 +133,7 @@ class Feature(models.Model):
                 toggles[ff.feature_code] = ff.current_status() == 'Y'
         del features
 
-        return utility_service.store(toggles)
+        return toggles
 
     @classmethod
     def get(cls, feature_info):
@@ -1,12 +1,41 @@
 from ..classes.log import Log
 from allauth.socialaccount.models import SocialAccount
-from mjg_base.classes.auth import Auth
+from mjg_base.classes.auth import Auth, request_attr
+from . import utility_service
+from django.core.cache import cache
 
 log = Log()
+avatar_cache_prefix = 'mjg_base~avatar~'
 
 
 def get_auth_instance():
-    return Auth()
+    """
+    Get the Auth instance for the current request.
+    Auth is only built once per request, and is then re-used by every auth_service call
+    """
+    request = utility_service.get_request()
+    if request is None:
+        return Auth()
+
+    auth = getattr(request, request_attr, None)
+
+    # Rebuild if there is no instance yet, or if the user logged in/out during this request
+    if auth is None or auth.source_user is not request.user:
+        auth = Auth()
+        auth.attach_to_request()
+
+    return auth
+
+
+def clear_auth_instance(request=None):
+    """
+    Discard the Auth instance for the current (or given) request.
+    The next call to get_auth_instance() will rebuild it from the session
+    """
+    if request is None:
+        request = utility_service.get_request()
+    if request is not None and hasattr(request, request_attr):
+        delattr(request, request_attr)
 
 
 def is_logged_in():
@@ -52,23 +81,65 @@ def has_authority(authority_list, use_impersonated=True):
         return get_authenticated_user().has_authority(authority_list)
 
 
+def has_any_authority(authority_list, use_impersonated=True):
+    """
+    Does the current user have at least one of the specified authorities?
+    """
+    return has_authority(authority_list, use_impersonated)
+
+
+def has_all_authorities(authority_list, use_impersonated=True):
+    """
+    Does the current user have every one of the specified authorities?
+    """
+    if use_impersonated:
+        return get_user().has_all_authorities(authority_list)
+    else:
+        return get_authenticated_user().has_all_authorities(authority_list)
+
+
 def can_impersonate():
     return get_auth_instance().can_impersonate()
 
 
 def get_avatar_url():
+    """
+    Get the social account avatar URL of the current user, or the local URL of their Gravatar image.
+    Social avatar URLs are cached per user, and are cleared when the user logs in or their social accounts change
+    """
     try:
         user = get_user()
-        if user and user.django_user():
-            for account in SocialAccount.objects.filter(user=user.django_user()):
-                if account.get_avatar_url():
-                    return account.get_avatar_url()
+        if not (user and user.is_valid() and user.id):
+            return None
+
+        key = f"{avatar_cache_prefix}{user.id}"
+        avatar_url = cache.get(key)
+        if avatar_url is None:
+            avatar_url = ''
+            for account in SocialAccount.objects.filter(user_id=user.id):
+                account_avatar_url = account.get_avatar_url()
+                if account_avatar_url:
+                    avatar_url = account_avatar_url
+                    break
+            # Users without an avatar are cached as '' to prevent repeated lookups
+            cache.set(key, avatar_url, utility_service.get_setting('AVATAR_CACHE_SECONDS'))
+
+        # Users without a social account avatar get their Gravatar image, if they have one
+        return avatar_url if avatar_url else utility_service.get_gravatar_image_src(user.email)
 
     except Exception as ee:
-        log.error("Could not get avatar URL: {ee}")
+        log.error(f"Could not get avatar URL: {ee}")
         return None
 
 
+def clear_avatar_url(user_id):
+    """
+    Remove a user's cached avatar URL
+    """
+    if user_id:
+        cache.delete(f"{avatar_cache_prefix}{user_id}")
+
+
 def start_impersonating(user_data):
     return get_auth_instance().set_impersonated_user(user_data)
 
@@ -77,5 +148,9 @@ def stop_impersonating():
     return get_auth_instance().set_impersonated_user(None)
 
 
+def start_proxying(user_data):
+    return get_auth_instance().set_proxied_user(user_data)
+
+
 def is_impersonating():
     return get_auth_instance().is_impersonating()
@@ -1,40 +1,50 @@
 from ..classes.log import Log
 from . import utility_service, error_service
 from mjg_base.models import Contact
+from django.db import transaction, IntegrityError
 
 log = Log()
 
 
 def create_contact_from_user(user_instance):
-    # If user has no Contact info, create it now
-    if user_instance:
-        try:
-            ct = user_instance.contact
-            if ct:
-                return ct
-        except:
-            ct = None
-
-    # Look for existing contact with same email address
-    ct = Contact.get(user_instance.email)
-    if ct:
+    """
+    Get the Contact for a User, linking an existing Contact or creating a new one as needed.
+    This is idempotent: repeated (or concurrent) calls will never create duplicate Contacts
+    """
+    if not (user_instance and user_instance.email):
+        return None
+
+    # If user already has Contact info, nothing to provision
+    try:
+        return user_instance.contact
+    except Contact.DoesNotExist:
+        pass
+
+    log.trace([user_instance])
+
+    # First and last are required, but may not exist in user object
+    placeholder = user_instance.username if user_instance.username else user_instance.email.split('@')[0]
+    try:
+        with transaction.atomic():
+            ct, created = Contact.objects.get_or_create(
+                email=user_instance.email,
+                defaults={
+                    'user': user_instance,
+                    'first_name': user_instance.first_name if user_instance.first_name else placeholder,
+                    'last_name': user_instance.last_name if user_instance.last_name else placeholder,
+                }
+            )
+    except IntegrityError:
+        # Contact was created by a concurrent request
+        ct = Contact.get(user_instance.email)
+        created = False
+
+    # If an existing contact was found, update user to match Contact
+    if ct and not created and ct.user_id != user_instance.id:
         user_instance.first_name = ct.first_name
         user_instance.last_name = ct.last_name
-        user_instance.save()
+        user_instance.save(update_fields=['first_name', 'last_name'])
         ct.user = user_instance
-        ct.save()
-        return ct
+        ct.save(update_fields=['user', 'last_updated'])
 
-    # Create a new contact
-    # First and last are required, but may not exist in user object
-    placeholder = user_instance.username
-    if not placeholder:
-        placeholder = user_instance.email.split('@')[0]
-    ct = Contact()
-    ct.user = user_instance
-    ct.first_name = user_instance.first_name if user_instance.first_name else placeholder
-    ct.last_name = user_instance.last_name if user_instance.last_name else placeholder
-    ct.email = user_instance.email
-    ct.save()
     return ct
-
@@ -6,9 +6,8 @@
 from django.conf import settings
 from ..classes.log import Log
 from inspect import getframeinfo, stack
-from ..services import auth_service
+from ..services import auth_service, utility_service
 # from ..models.error import Error
-from crequest.middleware import CrequestMiddleware
 from . import message_service
 import os
 import traceback
@@ -37,7 +36,7 @@ def unexpected_error(error_display=None, error_system=None, debug_info=None):
 
     # Gather data
     src = get_caller_data()
-    request = CrequestMiddleware.get_request()
+    request = utility_service.get_request()
     path = request.path if request else '?'
     method = request.method if request else None
 
@@ -148,7 +147,7 @@ def get_caller_data():
 
 def _get_parameters():
     """Get parameters as dict. This is mostly for logging parameters."""
-    request = CrequestMiddleware.get_request()
+    request = utility_service.get_request()
     if request:
         pp = request.GET.items() if request.method == 'GET' else request.POST.items()
         return {kk: vv for kk, vv in pp}
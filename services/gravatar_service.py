@@ -0,0 +1,110 @@
+from django.core.cache import cache
+from django.urls import reverse
+from ..classes.log import Log
+from . import utility_service
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+import requests
+import hashlib
+import threading
+
+log = Log()
+cache_prefix = 'mjg_base~gravatar~'
+
+# One HTTP session (and connection pool) is shared by all fetches
+_session = None
+_session_lock = threading.Lock()
+
+# Fetches run in the background so that page rendering never waits on gravatar.com
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='gravatar')
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def get_image_src(email_address):
+    """
+    Get a local URL for the user's Gravatar image, or None if they do not have one.
+    If the image has not been fetched yet, a background fetch is started and None is returned for now.
+    """
+    if utility_service.get_setting('DISABLE_GRAVATAR') or not email_address:
+        return None
+
+    email_hash = get_email_hash(email_address)
+    image_hash = cache.get(f"{cache_prefix}email~{email_hash}")
+
+    # Not fetched yet (or cache expired)
+    if image_hash is None:
+        with _pending_lock:
+            start_fetch = email_hash not in _pending
+            _pending.add(email_hash)
+        if start_fetch:
+            _executor.submit(_fetch_in_background, email_hash)
+        return None
+
+    # Empty string means the user has no Gravatar image
+    if not image_hash:
+        return None
+
+    return reverse('base:gravatar', args=[image_hash])
+
+
+def get_image(image_hash):
+    """
+    Get a fetched image as {'content': bytes, 'content_type': str}, or None if not cached
+    """
+    return cache.get(f"{cache_prefix}image~{image_hash}")
+
+
+def fetch(email_hash):
+    """
+    Fetch an image from Gravatar and cache it (content-addressed) for all users with the same image.
+    Returns the image hash, or '' if the user has no Gravatar image.
+    Users without an image are cached as well, so gravatar.com is not asked again until the cache expires.
+    """
+    log.trace([email_hash])
+    timeout = utility_service.get_setting('GRAVATAR_CACHE_SECONDS')
+    image_hash = ''
+    try:
+        # d=404 returns a 404 rather than a default image for users without an image
+        response = _get_session().get(
+            f"{utility_service.get_setting('GRAVATAR_URL')}{email_hash}",
+            params={'s': 200, 'd': 404},
+            timeout=utility_service.get_setting('GRAVATAR_TIMEOUT')
+        )
+        if response.status_code == 200 and response.content:
+            image_hash = hashlib.sha256(response.content).hexdigest()
+            image = {'content': response.content, 'content_type': response.headers.get('Content-Type', 'image/jpeg')}
+            cache.set(f"{cache_prefix}image~{image_hash}", image, timeout)
+
+    except Exception as ee:
+        # Do not remember failures for as long as actual responses
+        log.warning(f"Error getting Gravatar image: {ee}")
+        timeout = min(timeout, 300) if timeout else 300
+
+    cache.set(f"{cache_prefix}email~{email_hash}", image_hash, timeout)
+    return log.end(image_hash)
+
+
+def get_email_hash(email_address):
+    return hashlib.md5(email_address.strip().lower().encode()).hexdigest()
+
+
+def _fetch_in_background(email_hash):
+    try:
+        fetch(email_hash)
+    finally:
+        with _pending_lock:
+            _pending.discard(email_hash)
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
@@ -40,7 +40,7 @@ def post_message(msg, msg_type, add_icon=True):
     msg_level = getattr(messages, msg_type.upper())
 
     if request is None:
-        log.error(f"Request does not exist. Could not post message: {message}")
+        log.error("Request does not exist. Could not post message: %s", message)
     else:
         # Look through messages without clearing them
         msg_list = messages.get_messages(request)
@@ -49,9 +49,9 @@ def post_message(msg, msg_type, add_icon=True):
 
         # If message is a duplicate, do not post it
         if duplicate_flag:
-            log_msg = f"[DUPLICATE] {msg}"
+            log_prefix = "[DUPLICATE]"
         else:
-            log_msg = f"[POSTED] {msg}"
+            log_prefix = "[POSTED]"
 
             # Convert fa-class to a FontAwesome icon
             contains_icon = False
@@ -72,17 +72,17 @@ def post_message(msg, msg_type, add_icon=True):
                     "warning": "fal fa-comment-exclamation",
                     "error": "fal fa-comment-times",
                 }
-                log.debug(f"Level: {msg_type} Gets icon: {std_icons.get(msg_type)}")
+                log.debug("Level: %s Gets icon: %s", msg_type, std_icons.get(msg_type))
                 message = f"""<i class="fa {std_icons.get(msg_type)}" aria-hidden="true"></i> {message}"""
 
             messages.add_message(request, msg_level, message)
 
         # Always log it (including duplicates)
         if msg_type == "error":
-            log.error(log_msg, trace_error=False, strip_html=True)
+            log.error("%s %s", log_prefix, msg, trace_error=False, strip_html=True)
         elif msg_type == "warning":
-            log.warning(log_msg, strip_html=True)
+            log.warning("%s %s", log_prefix, msg, strip_html=True)
         else:
-            log.info(log_msg, strip_html=True)
+            log.info("%s %s", log_prefix, msg, strip_html=True)
 
     return None
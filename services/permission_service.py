@@ -0,0 +1,168 @@
+from django.core.cache import cache
+from django.db.models import Q
+from ..classes.log import Log
+from . import utility_service
+from ..models.auth.permission import Permission
+from ..models.auth.authority import Authority
+from datetime import datetime
+import time
+
+log = Log()
+cache_prefix = 'mjg_base~authorities'
+
+
+def get_authority_map(user_id):
+    """
+    Get a dict of {authority_code: authority_title} for the user's active permissions
+    """
+    return get_authority_snapshot(user_id)['authorities']
+
+
+def get_authority_snapshot(user_id):
+    """
+    Get the user's active authorities, and the time (epoch seconds) at which they next change.
+        {'authorities': {authority_code: authority_title}, 'expires': timestamp-or-None, 'version': version}
+
+    The snapshot is shared across requests via the Django cache, and is invalidated when permissions change
+    or when a permission's effective_date or end_date passes
+    """
+    if not user_id:
+        return {'authorities': {}, 'expires': None, 'version': None}
+
+    version = get_version(user_id)
+    snapshot = cache.get(_get_map_key(user_id, version))
+    if snapshot is not None and not is_expired(snapshot['expires']):
+        return snapshot
+
+    log.trace([user_id])
+    snapshot = build_snapshot(get_pending_permissions().filter(user_id=user_id))
+    snapshot['version'] = version
+    cache_snapshot(user_id, snapshot)
+    return snapshot
+
+
+def get_authority_titles(authority_codes):
+    """
+    Get a dict of {authority_code: authority_title} for the given codes.
+    Titles of all authorities are cached together, since there are relatively few of them
+    """
+    key = f"{cache_prefix}~titles~{_get_global_version()}"
+    titles = cache.get(key)
+    if titles is None:
+        log.trace()
+        titles = dict(Authority.objects.values_list('code', 'title'))
+        cache.set(key, titles, utility_service.get_setting('AUTHORITY_CACHE_SECONDS'))
+    return {cc: titles.get(cc, cc) for cc in authority_codes} if authority_codes else {}
+
+
+def get_pending_permissions():
+    """
+    Get a queryset of active and future permissions (with their authorities)
+    """
+    now = datetime.now()
+    permissions = Permission.objects.select_related('authority')
+    return permissions.filter(Q(end_date__isnull=True) | Q(end_date__gt=now))
+
+
+def build_snapshot(permissions):
+    """
+    Build an authority snapshot from a user's active and future permissions
+    """
+    now = datetime.now()
+    authority_map = {}
+    transitions = []
+
+    # Future permissions determine when authorities will next change
+    for pp in permissions:
+        if pp.end_date and pp.end_date <= now:
+            continue
+        if pp.effective_date and pp.effective_date > now:
+            transitions.append(pp.effective_date)
+        else:
+            authority_map[pp.authority.code] = pp.authority.title
+            if pp.end_date:
+                transitions.append(pp.end_date)
+
+    return {
+        'authorities': authority_map,
+        'expires': min(transitions).timestamp() if transitions else None,
+    }
+
+
+def cache_snapshot(user_id, snapshot):
+    """
+    Share a user's authority snapshot with other requests (until it expires)
+    """
+    timeout = utility_service.get_setting('AUTHORITY_CACHE_SECONDS')
+    if snapshot['expires']:
+        seconds_left = int(snapshot['expires'] - time.time()) + 1
+        timeout = min(timeout, seconds_left) if timeout else seconds_left
+    cache.set(_get_map_key(user_id, snapshot.get('version')), snapshot, timeout)
+
+
+def is_expired(expires):
+    """
+    Has the given snapshot expiration time (epoch seconds) passed?
+    """
+    return bool(expires) and expires <= time.time()
+
+
+def get_version(user_id):
+    """
+    Get the permissions version for a user (changes whenever the user's permissions change)
+    """
+    keys = [f"{cache_prefix}~v~all", f"{cache_prefix}~v~{user_id}"]
+    counters = cache.get_many(keys)
+    return ".".join([str(counters[kk] if kk in counters else _init_counter(kk)) for kk in keys])
+
+
+def get_versions(user_ids):
+    """
+    Get the permissions versions of several users at once, as {user_id: version}
+    """
+    global_key = f"{cache_prefix}~v~all"
+    user_keys = {user_id: f"{cache_prefix}~v~{user_id}" for user_id in user_ids}
+    counters = cache.get_many([global_key] + list(user_keys.values()))
+    global_version = counters[global_key] if global_key in counters else _init_counter(global_key)
+    return {
+        user_id: f"{global_version}.{counters[kk] if kk in counters else _init_counter(kk)}"
+        for user_id, kk in user_keys.items()
+    }
+
+
+def invalidate_user(user_id):
+    """
+    Invalidate cached authorities for a single user
+    """
+    _bump_counter(f"{cache_prefix}~v~{user_id}")
+
+
+def invalidate_all():
+    """
+    Invalidate cached authorities for all users (i.e. an authority was renamed or removed)
+    """
+    _bump_counter(f"{cache_prefix}~v~all")
+
+
+def _get_map_key(user_id, version=None):
+    return f"{cache_prefix}~{user_id}~{version if version else get_version(user_id)}"
+
+
+def _get_global_version():
+    key = f"{cache_prefix}~v~all"
+    version = cache.get(key)
+    return version if version is not None else _init_counter(key)
+
+
+def _init_counter(key):
+    # Start from the current time so an evicted counter never resumes at a previously-used version
+    cache.add(key, int(time.time() * 1000), None)
+    return cache.get(key)
+
+
+def _bump_counter(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Counter did not exist yet
+        _init_counter(key)
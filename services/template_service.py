@@ -26,7 +26,7 @@ def get_sass_color(var_name, default):
         if hasattr(settings, var_name):
             result = settings.__getattr__(var_name)
     except Exception as ee:
-        log.error(f"Error getting SASS color: {ee}")
+        log.error("Error getting SASS color: %s", ee)
 
     # Convert to SassColor
     result = convert_sass_color(result if result else default)
@@ -48,7 +48,7 @@ def get_sass_string(var_name, default):
         if hasattr(settings, var_name):
             result = settings.__getattr__(var_name)
     except Exception as ee:
-        log.error(f"Error getting SASS string: {ee}")
+        log.error("Error getting SASS string: %s", ee)
         result = None
 
     if not result:
@@ -107,7 +107,7 @@ def convert_sass_color(given_value):
 
         # No other formats are accounted for yet
         else:
-            log.error(f"Unexpected color format: {given_value}")
+            log.error("Unexpected color format: %s", given_value)
             log.debug("Currently only handling HTML color names, hex codes, and RGB or RGBA tuples")
 
         if rgba_color:
@@ -115,7 +115,7 @@ def convert_sass_color(given_value):
             sass_color = sass.SassColor(*rgba_color)
 
     except Exception as ee:
-        log.error(f"Error converting SASS color: {ee}")
+        log.error("Error converting SASS color: %s", ee)
 
     log.end(sass_color)
     return sass_color
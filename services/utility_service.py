@@ -1,35 +1,81 @@
 from django.conf import settings
 from django.db.models import Q
+from django.core import signing
 from ..classes.log import Log
+from ..classes.session_facade import SessionFacade
+from ..classes.settings_snapshot import SettingsSnapshot
 from crequest.middleware import CrequestMiddleware
-from inspect import getframeinfo, stack, getmembers
 from collections import OrderedDict
+from functools import wraps, lru_cache
+from contextvars import ContextVar
+from types import MappingProxyType
 import re
 import os
-import hashlib
-import requests
-import base64
 import sys
+import importlib
 from io import StringIO
 from html.parser import HTMLParser
 
+from . import gravatar_service
+
 log = Log()
 unit_test_session = {'modified': False, 'warned': False}
 session_prefix = 'demo~'
+page_scope = ContextVar('mjg_page_scope', default=None)
+current_request = ContextVar('mjg_request', default=None)
+flash_scope_var = 'flash_scope'
+_settings_snapshot = None
+_plugin_registry = None
+pagination_state_param = 'ps'
+pagination_state_salt = 'mjg_base.pagination'
 
 
 def get_setting(property_name, default_value=None):
     """
     Get the value of a setting from settings or local_settings
     """
-    return getattr(settings, property_name) if hasattr(settings, property_name) else default_value
+    return getattr(settings, property_name, default_value)
+
+
+def get_settings_snapshot():
+    """
+    Get the read-only snapshot of frequently-checked settings (built at AppConfig.ready)
+    """
+    return _settings_snapshot if _settings_snapshot is not None else refresh_settings_snapshot()
+
+
+def refresh_settings_snapshot():
+    """
+    Rebuild the settings snapshot (i.e. when a test overrides a setting)
+    """
+    global _settings_snapshot
+    _settings_snapshot = SettingsSnapshot()
+    return _settings_snapshot
+
+
+def get_plugin_setting(plugin_name, setting_name, default_value=None):
+    """
+    Get a plugin-specific setting from settings, or from the plugin's _DEFAULTS if not overridden
+    """
+    if hasattr(settings, setting_name):
+        return getattr(settings, setting_name)
+
+    for module_name in [plugin_name, f"{plugin_name}.apps"]:
+        try:
+            plugin_defaults = getattr(importlib.import_module(module_name), '_DEFAULTS', None)
+        except Exception:
+            continue
+        if plugin_defaults and setting_name in plugin_defaults:
+            return plugin_defaults[setting_name]
+
+    return default_value
 
 
 def get_app_code():
     """
     Get the code that uniquely identifies this site
     """
-    return get_setting('APP_CODE')
+    return get_settings_snapshot().app_code
 
 
 def get_app_name():
@@ -37,65 +83,75 @@ def get_app_name():
     Get the human-readable name of the current application
     This is mainly used in administrative views
     """
-    return get_setting("APP_NAME")
+    return get_settings_snapshot().app_name
 
 
 def get_app_version():
     """
     Get the version of the current application or sub-application
     """
-    # Try to get from current app's (or sub-app's) __init__ version
-    current_app_code = get_app_code().lower()
-    try:
-        for stuff in getmembers(sys.modules[current_app_code]):
-            if "__version__" in stuff:
-                return stuff[1]
-    except Exception as ee:
-        log.debug(f"Cannot determine version of {current_app_code}")
-
-    # Return version from settings if not found in __init__
-    return get_setting("APP_VERSION")
+    return get_plugin_registry()['app_version']
 
 
 def get_installed_plugins():
     """
-    Get a dict of the installed MJG plugins and their versions
+    Get a read-only mapping of the installed apps and their versions
     """
+    return get_plugin_registry()['plugins']
+
+
+def get_plugin_registry():
+    """
+    Get the installed apps and versions (computed once, when the app registry is ready)
+    """
+    return _plugin_registry if _plugin_registry is not None else refresh_plugin_registry()
+
+
+def refresh_plugin_registry():
+    """
+    Rebuild the plugin registry (i.e. when a test overrides INSTALLED_APPS)
+    """
+    global _plugin_registry
     installed_apps = {}
-    for app_name in get_setting('INSTALLED_APPS'):
-        version = "?"
-        try:
-            for stuff in getmembers(sys.modules[f'{app_name}']):
-                if '__version__' in stuff:
-                    version = stuff[1]
-        except Exception as ee:
-            log.debug(f"Cannot determine version of {app_name}")
-        installed_apps[app_name] = version
+    for app_name in get_setting('INSTALLED_APPS', []):
+        installed_apps[app_name] = _get_module_version(app_name, "?")
+
+    # Version from current app's (or sub-app's) __init__, or from settings if not found
+    app_code = get_app_code()
+    app_version = _get_module_version(app_code.lower(), None) if app_code else None
+    if app_version is None:
+        log.debug(f"Cannot determine version of {app_code}")
+        app_version = get_setting("APP_VERSION")
+
+    _plugin_registry = MappingProxyType({
+        'plugins': MappingProxyType(installed_apps),
+        'app_version': app_version,
+    })
+    return _plugin_registry
 
-    return installed_apps
+
+def _get_module_version(module_name, default_value):
+    module = sys.modules.get(module_name)
+    return getattr(module, '__version__', default_value) if module else default_value
 
 
 def get_environment():
     """
     Get environment: DEV, STAGE, PROD
     """
-    env = settings.ENVIRONMENT.upper()
-    if env in ['DEV', 'STAGE', 'PROD']:
-        return env
-    else:
-        return 'DEV'
+    return get_settings_snapshot().environment
 
 
 def is_production():
-    return get_environment() == 'PROD'
+    return get_settings_snapshot().is_production
 
 
 def is_non_production():
-    return get_environment() != 'PROD'
+    return get_settings_snapshot().is_non_production
 
 
 def is_development():
-    return (get_environment() == 'DEV') and settings.DEBUG
+    return get_settings_snapshot().is_development
 
 
 def get_static_content_url():
@@ -113,7 +169,25 @@ def is_health_check():
 
 
 def get_request():
-    return CrequestMiddleware.get_request()
+    """
+    Get the current request (works under both WSGI and ASGI)
+    """
+    request = current_request.get()
+    if request is None:
+        # Request may not have passed through MjgBaseMiddleware yet
+        return CrequestMiddleware.get_request()
+    return request
+
+
+def set_request(request):
+    """
+    Set the current request (called by MjgBaseMiddleware). Returns a token for reset_request()
+    """
+    return current_request.set(request)
+
+
+def reset_request(token):
+    current_request.reset(token)
 
 
 def get_parameters():
@@ -140,7 +214,8 @@ def is_ajax():
 
 
 def pagination_sort_info(
-        request, default_sort="id", default_order="asc", filter_name=None, reset_page=False, sort_tuple=True
+        request, default_sort="id", default_order="asc", filter_name=None, reset_page=False, sort_tuple=True,
+        signed_state=None
 ):
     """
     Get the pagination sort order and page info.
@@ -153,6 +228,8 @@ def pagination_sort_info(
         filter_name:    If view is filtering on a keyword string, or list of keyword strings, maintain that here as well
         reset_page:     True will force back to page 1 (i.e. new search/filter terms submitted)
         sort_tuple:     Return tuple rather than string as sort parameter. Allows multiple sort columns.
+        signed_state:   Track state in a signed query-string token rather than the session.
+                        Defaults to the PAGINATION_SIGNED_STATE setting.
     Returns tuple: (sortby-string-or-tuple, page-number)
         sortby-string includes column and direction ('id', '-id')
         page-number is recommended page number (reset to 1 after sort change)
@@ -178,14 +255,27 @@ def pagination_sort_info(
     for ff in filter_name_list:
         filter_vars[ff] = f"{fn}-filter-{ff}"
 
+    if signed_state is None:
+        signed_state = get_setting('PAGINATION_SIGNED_STATE', False)
+
     # Get default sort, order, filter, page
-    default_sort = get_session_var(sort_var, default_sort)
-    default_order = get_session_var(order_var, default_order)
-    default_page = get_session_var(page_var, 1)
+    if signed_state:
+        state = _load_pagination_state(request, fn)
+        default_sort = state.get('s', default_sort)
+        default_order = state.get('o', default_order)
+        default_page = state.get('p', 1)
+    else:
+        state = None
+        default_sort = get_session_var(sort_var, default_sort)
+        default_order = get_session_var(order_var, default_order)
+        default_page = get_session_var(page_var, 1)
 
     default_filters = {}
     for ff in filter_name_list:
-        default_filters[ff] = get_session_var(filter_vars[ff], None)
+        if signed_state:
+            default_filters[ff] = state.get('f', {}).get(ff)
+        else:
+            default_filters[ff] = get_session_var(filter_vars[ff], None)
 
     # Make default sort a tuple
     if type(default_sort) in [tuple, list]:
@@ -285,20 +375,16 @@ def pagination_sort_info(
     if reset_page:
         page = 1
 
-    # Remember sort preference
-    set_session_var(sort_var, sort)
-    set_session_var(order_var, order)
-    set_session_var(page_var, page)
-    for ff in filter_name_list:
-        set_session_var(filter_vars[ff], filter_strings[ff])
+    # Remember sort preference in a signed token (no session writes)
+    if signed_state:
+        _save_pagination_state(fn, sort, order, page, filter_strings)
 
-    # Sortable column header taglib needs to know the last-sorted column
-    # This assumes only one sorted dataset is being displayed at a time
-    set_session_var('psu_last_secondary_sorted_column', sort[1] if type(sort) is tuple and len(sort) > 1 else sort)
-    set_session_var('psu_last_sorted_column', sort[0] if type(sort) is tuple else sort)
-    set_session_var('psu_last_sorted_direction', order)
+    # Remember sort preference
+    else:
+        _save_session_pagination_state(sort_var, order_var, page_var, filter_vars, sort, order, page, filter_strings)
 
     oo = '-' if order == 'desc' else ''
+
     if type(sort) is tuple:
         sort_param = ()
         for vv in sort:
@@ -325,6 +411,69 @@ def pagination_sort_info(
     return return_val
 
 
+def _save_session_pagination_state(sort_var, order_var, page_var, filter_vars, sort, order, page, filter_strings):
+    set_session_var(sort_var, sort)
+    set_session_var(order_var, order)
+    set_session_var(page_var, page)
+    for ff, filter_var in filter_vars.items():
+        set_session_var(filter_var, filter_strings[ff])
+
+    # Sortable column header taglib needs to know the last-sorted column
+    # This assumes only one sorted dataset is being displayed at a time
+    set_session_var('psu_last_secondary_sorted_column', sort[1] if type(sort) is tuple and len(sort) > 1 else sort)
+    set_session_var('psu_last_sorted_column', sort[0] if type(sort) is tuple else sort)
+    set_session_var('psu_last_sorted_direction', order)
+
+
+def _load_pagination_state(request, key):
+    """
+    Private function
+    Get pagination state from the signed query-string token (or an empty dict if missing or invalid)
+    """
+    token = request.GET.get(pagination_state_param)
+    if not token:
+        return {}
+    try:
+        state = signing.loads(token, salt=pagination_state_salt)
+    except signing.BadSignature:
+        log.warning("Ignoring invalid pagination state token")
+        return {}
+
+    # Token must have been issued for this list
+    if type(state) is not dict or state.get('k') != key:
+        return {}
+    if state.get('s') is not None:
+        state['s'] = tuple(state['s'])
+    return state
+
+
+def _save_pagination_state(key, sort, order, page, filter_strings):
+    """
+    Private function
+    Encode pagination state as a signed token for sortable_th and pagination tags to include in their links
+    """
+    # Primary and secondary sort columns are all that's needed (prevents accumulation)
+    sort = list(sort[:2]) if type(sort) is tuple else sort
+    state = {'k': key, 's': sort, 'o': order, 'p': page}
+    if filter_strings:
+        state['f'] = filter_strings
+
+    set_page_scope('pagination_state', {
+        'token': signing.dumps(state, salt=pagination_state_salt, compress=True),
+        'sorted_column': sort[0] if type(sort) is list else sort,
+        'secondary_sorted_column': sort[1] if type(sort) is list and len(sort) > 1 else None,
+        'sorted_direction': order,
+    })
+
+
+def get_pagination_state_param():
+    """
+    Get the query-string parameter (i.e. '&ps=<token>') that carries signed pagination state, if any
+    """
+    state = get_page_scope('pagination_state')
+    return f"&{pagination_state_param}={state['token']}" if state else ''
+
+
 def get_session():
     # While unit testing, there will be no request
     request = get_request()
@@ -344,19 +493,64 @@ def get_session():
         return request.session
 
 
+def get_session_facade():
+    """
+    Get the SessionFacade that buffers custom session variables for the current request
+    Returns None when there is no request (assumed unit testing)
+    """
+    request = get_request()
+    if request is None:
+        return None
+    facade = getattr(request, '_mjg_session_facade', None)
+    if facade is None:
+        facade = SessionFacade(request.session)
+        setattr(request, '_mjg_session_facade', facade)
+    return facade
+
+
+def flush_session_vars():
+    """
+    Write changed custom session variables to the session (called by MjgBaseMiddleware after the view)
+    """
+    request = get_request()
+    facade = getattr(request, '_mjg_session_facade', None) if request else None
+    return facade.flush() if facade else 0
+
+
+def get_session_stats():
+    """
+    Get session usage statistics (see SessionFacade.get_stats)
+    """
+    return SessionFacade.get_stats()
+
+
 def set_session_var(var, val):
     # Prefix all custom session entries
     var = f"{session_prefix}{var}"
-    session = get_session()
-    session[var] = val
-    return val
+    facade = get_session_facade()
+    if facade is None:
+        get_session()[var] = val
+        return val
+    return facade.set(var, val)
 
 
 def get_session_var(var, alt=None):
     # Prefix all custom session entries
     var = f"{session_prefix}{var}"
-    session = get_session()
-    return session.get(var, alt)
+    facade = get_session_facade()
+    if facade is None:
+        return get_session().get(var, alt)
+    return facade.get(var, alt)
+
+
+def delete_session_var(var):
+    # Prefix all custom session entries
+    var = f"{session_prefix}{var}"
+    facade = get_session_facade()
+    if facade is None:
+        get_session().pop(var, None)
+    else:
+        facade.delete(var)
 
 
 def clear_custom_session_vars(preserve=None):
@@ -364,6 +558,7 @@ def clear_custom_session_vars(preserve=None):
     if preserve and type(preserve) is not list:
         preserve = [preserve]
     keep = [f"{session_prefix}{kk}" for kk in preserve] if preserve else None
+
     for kk in list(request.session.keys()):
         if kk.startswith(session_prefix):
             if keep and kk in keep:
@@ -372,60 +567,70 @@ def clear_custom_session_vars(preserve=None):
                 del request.session[kk]
     request.session.modified = True
 
+    # Buffered changes to preserved values are still written at the end of the request
+    get_session_facade().reset(preserve=keep)
+
 
 def set_page_scope(var, val):
-    var_name = f"page_scope_{var}"
-    set_session_var(var_name, val)
+    """
+    Store a value for the remainder of the current request (it is discarded when the response is complete)
+    """
+    _get_page_scope_container()[var] = val
     return val
 
 
 def get_page_scope(var, alt=None):
-    var_name = f"page_scope_{var}"
-    return get_session_var(var_name, alt)
+    container = page_scope.get()
+    return container.get(var, alt) if container else alt
+
+
+def _get_page_scope_container():
+    """
+    Private function
+    Page-scoped values are kept in memory (not the session), in a container local to the current request
+    """
+    container = page_scope.get()
+    if container is None:
+        container = {}
+        page_scope.set(container)
+    return container
 
 
 def set_flash_scope(var, val):
-    var_name = f"flash_scope_{var}"
-    set_session_var(var_name, val)
+    """
+    Store a value for the remainder of this request, and the next request
+    """
+    container = get_session_var(flash_scope_var) or {'generation': 0, 'vars': {}}
+    container['vars'][var] = [container['generation'], val]
+    set_session_var(flash_scope_var, container)
     return val
 
 
 def get_flash_scope(var, alt=None):
-    # Get the value saved in previous request
-    prev_var_name = f"flashed_scope_{var}"
-    previous_flash_value = get_session_var(prev_var_name, alt)
-
-    # Get new value if overwritten during the current request
-    new_var_name = f"flash_scope_{var}"
-    new_flash_value = get_session_var(new_var_name, 'flash-variable-not-set')
-
-    # return the more recent of the two
-    # (flash variable from last request can be overwritten this request)
-    if new_flash_value != 'flash-variable-not-set':
-        return new_flash_value
-    else:
-        return previous_flash_value
+    container = get_session_var(flash_scope_var)
+    entry = container['vars'].get(var) if container else None
+
+    # Values set in this request, or the previous request, are still in scope
+    if entry and entry[0] >= container['generation'] - 1:
+        return entry[1]
+    return alt
 
 
 def cycle_flash_scope():
-    session = get_session()
-    flash_vars = []
-    flashed_vars = []
-    for kk in session.keys():
-        if kk.startswith(f'{session_prefix}flash_scope_'):
-            flash_vars.append(kk)
-        elif kk.startswith(f'{session_prefix}flashed_scope_'):
-            flashed_vars.append(kk)
-    # Remove the keys from the flashed scope
-    for kk in flashed_vars:
-        del session[kk]
-    # Move flash vars to flashed scope
-    for kk in flash_vars:
-        new_kk = kk.replace('flash_', 'flashed_')
-        session[new_kk] = session[kk]
-        del session[kk]
-
-    session['modified'] = True
+    """
+    Start a new flash-scope generation, removing values set prior to the previous request.
+    The session is not touched at all when there is no flash data.
+    """
+    container = get_session_var(flash_scope_var)
+    if not container:
+        return
+
+    generation = container['generation'] + 1
+    flash_vars = {kk: vv for kk, vv in container['vars'].items() if vv[0] >= generation - 1}
+    if flash_vars:
+        set_session_var(flash_scope_var, {'generation': generation, 'vars': flash_vars})
+    else:
+        delete_session_var(flash_scope_var)
 
 
 def clear_breadcrumbs():
@@ -511,15 +716,66 @@ def _get_cache_key():
     UPDATE: This is also used for remembering pagination sort/order
     """
     # Ignore this function, and the store/recall function that called it
-    depth = 2
-
-    # Get the info about the function that called the store/recall function
-    caller = getframeinfo(stack()[depth][0])
+    # (sys._getframe does not build the whole stack or read source files, like inspect.stack() does)
+    caller = sys._getframe(2).f_code
 
     # Use filename without .py extension
-    filename = os.path.basename(caller.filename)[:-3]
+    filename = os.path.basename(caller.co_filename)[:-3]
+
+    return f"cache-{filename}-{caller.co_name}"
+
+
+def request_cached(func):
+    """
+    Decorator: Remember a function's result for the rest of the current request.
+    Results are keyed by the function's qualified name and its (hashable) arguments.
+    Calls with unhashable arguments, or made outside a request, are not cached.
+
+    Use func.clear_request_cache() to forget all results of the function for the current request.
+    Note: If the cached response is mutable, changes made to the returned value will affect the cached instance as well
+    """
+    func_key = f"{func.__module__}.{func.__qualname__}"
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        request_cache = _get_request_cache()
+        if request_cache is None:
+            return func(*args, **kwargs)
+
+        try:
+            key = (args, frozenset(kwargs.items())) if kwargs else args
+            results = request_cache.setdefault(func_key, {})
+            if key in results:
+                return results[key]
+        except TypeError:
+            # Unhashable arguments
+            return func(*args, **kwargs)
+
+        results[key] = result = func(*args, **kwargs)
+        return result
+
+    def clear_request_cache():
+        request_cache = _get_request_cache()
+        if request_cache:
+            request_cache.pop(func_key, None)
+
+    wrapper.clear_request_cache = clear_request_cache
+    return wrapper
+
 
-    return f"cache-{filename}-{caller.function}"
+def _get_request_cache():
+    """
+    Private function
+    Get the dict used by @request_cached for the current request (None if there is no request)
+    """
+    request = get_request()
+    if request is None:
+        return None
+    request_cache = getattr(request, '_mjg_request_cache', None)
+    if request_cache is None:
+        request_cache = {}
+        setattr(request, '_mjg_request_cache', request_cache)
+    return request_cache
 
 
 def test_cache_key():
@@ -540,17 +796,10 @@ def test_store_recall(value=None):
 
 
 def clear_page_scope():
-    log.trace()
-    session = get_session()
-    temp_vars = []
-    for kk in session.keys():
-        if kk.startswith(f'{session_prefix}page_scope_'):
-            temp_vars.append(kk)
-    # Remove the keys from the session
-    for kk in temp_vars:
-        del session[kk]
-
-    session['modified'] = True
+    """
+    Discard all page-scoped values (called by MjgBaseMiddleware at the start and end of each request)
+    """
+    page_scope.set(None)
 
 
 def csv_to_list(src, convert_int=False):
@@ -587,47 +836,37 @@ def csv_to_list(src, convert_int=False):
 def get_gravatar_image_src(email_address):
     """
         If the user has a Gravatar image, it will be used as their default profile image.
+        Returns a local URL for the image (see gravatar_service), or None if there is no image (yet)
     """
-    if get_setting('DISABLE_GRAVATAR'):
-        return None
+    return gravatar_service.get_image_src(email_address)
 
-    if not email_address:
-        return None
-
-    log.trace([email_address])
-    try:
-        email = email_address.strip().lower()
-        m = hashlib.md5()
-        m.update(email.encode())
-        email_hash = m.hexdigest()
 
-        # ToDo: Provide an alt image so that a consistent response can indicate not having a Gravatar image
-        alt_img = f"/images/no-id-photo.png"
-        url = f"https://www.gravatar.com/avatar/{email_hash}?s=200&d={alt_img}"
+def format_phone(phone_number, no_special_chars=False):
+    """
+    Format a phone number.
+    """
+    return _format_phone(str(phone_number) if phone_number else '', bool(no_special_chars))
 
-        # Get the image data
-        b64img = base64.b64encode(requests.get(url).content).decode()
 
-        # If this is the default image, return None
-        if b64img.startswith('iVBORw0KGgoAAAANSUhEUgAAAQAAAAEACAMAAABrrFhUAAAAM1BMVEXn6+7g5em4xMvFz9XM1drk6Oy/ydCxvsa0wcn'):
-            return None
+def format_phones(phone_numbers, no_special_chars=False):
+    """
+    Format a list (or any iterable) of phone numbers. Returns a list in the same order.
+    """
+    return [format_phone(pn, no_special_chars) for pn in phone_numbers]
 
-        return """data:image/jpg;base64,{0}""".format(b64img)
 
-    except Exception as ee:
-        log.error(f"Error getting Gravatar image: {str(ee)}")
-        return None
+# Precompiled for format_phone
+_non_word_chars = re.compile(r'\W')
+_non_digits = re.compile(r'\D')
 
 
-def format_phone(phone_number, no_special_chars=False):
-    """
-    Format a phone number.
-    """
-    src = initial_string = str(phone_number) if phone_number else ''
+@lru_cache(maxsize=1024)
+def _format_phone(initial_string, no_special_chars):
+    src = initial_string
     if ' ext ' in initial_string:
         src = initial_string.replace(' ext ', '')
-    word_chars_only = re.sub(r'\W', "", src).upper()
-    digits_only = re.sub(r'\D', "", src)
+    word_chars_only = _non_word_chars.sub("", src).upper()
+    digits_only = _non_digits.sub("", src)
 
     # Remove unnecessary country code
     if len(digits_only) == 11 and digits_only.startswith('1'):
@@ -0,0 +1,58 @@
+from django.db.models.signals import post_save, post_delete
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.contrib.auth import signals as auth_signals
+from .models.auth.authority import Authority
+from .models.auth.permission import Permission
+from .services import permission_service, auth_service, utility_service
+from .classes.settings_snapshot import SettingsSnapshot
+from .classes.dynamic_role import DynamicRole
+from .classes.admin_link import AdminLink
+from .classes import auth_user
+from allauth.account.signals import user_logged_in
+from allauth.socialaccount.signals import social_account_added, social_account_updated, social_account_removed
+
+
+@receiver([post_save, post_delete], sender=Permission)
+def permission_changed(sender, instance, **kwargs):
+    permission_service.invalidate_user(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Authority)
+def authority_changed(sender, instance, **kwargs):
+    permission_service.invalidate_all()
+
+
+@receiver(user_logged_in)
+def user_logged_in_handler(sender, user, **kwargs):
+    auth_service.clear_avatar_url(user.id)
+
+
+@receiver([auth_signals.user_logged_in, auth_signals.user_logged_out])
+def auth_changed_handler(sender, request=None, **kwargs):
+    # The request's Auth instance belongs to the previous user. Rebuild it from the new session
+    auth_service.clear_auth_instance(request)
+
+
+@receiver([social_account_added, social_account_updated])
+def social_account_changed(sender, sociallogin, **kwargs):
+    auth_service.clear_avatar_url(sociallogin.user.id)
+
+
+@receiver(social_account_removed)
+def social_account_removed_handler(sender, socialaccount, **kwargs):
+    auth_service.clear_avatar_url(socialaccount.user_id)
+
+
+@receiver(setting_changed)
+def settings_changed_handler(sender, setting, **kwargs):
+    # Keep startup-computed settings in sync when tests override settings
+    if setting in SettingsSnapshot.source_settings:
+        utility_service.refresh_settings_snapshot()
+    if setting in ('INSTALLED_APPS', 'APP_CODE', 'APP_VERSION'):
+        utility_service.refresh_plugin_registry()
+    if setting == 'INSTALLED_APPS' or setting.endswith('DYNAMIC_ROLES'):
+        DynamicRole.compile()
+        auth_user._authority_keys.cache_clear()
+    if setting in ('INSTALLED_APPS', 'APP_CODE') or setting.endswith('_ADMIN_LINKS'):
+        AdminLink.compile()
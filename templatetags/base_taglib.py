@@ -6,6 +6,7 @@
 from django.conf import settings
 from django import template
 from ..classes.log import Log
+from ..classes.admin_link import AdminLink
 from ..models import Feature
 from ..services import utility_service, auth_service, date_service, validation_service
 from ..templatetags.tag_processing import supporting_functions as support, html_generating, static_content
@@ -214,19 +215,31 @@ def has_authority(authority_code, true_false):
         return False
 
 
+@register.filter
+def has_all_authorities(authority_list, true_false):
+    """
+    Check if current user does/does not have every one of the given authorities
+
+    'admin,infotext'|has_all_authorities:True   - Does user have both admin and infotext?
+    'admin,infotext'|has_all_authorities:False  - Is user missing admin or infotext?
+    """
+    has_them = auth_service.has_all_authorities(authority_list)
+    if true_false and has_them:
+        return True
+    elif (not true_false) and (not has_them):
+        return True
+    else:
+        return False
+
+
 @register.simple_tag(takes_context=True)
 def check_admin_menu(context, *args, **kwargs):
-    # All power users see the admin menu
-    admin_menu_roles = []
-
-    # Other MJG plugins may include items for specific roles other than power-user roles
-    for admin_link in context['plugin_admin_links']:
-        if 'authorities' in admin_link:
-            plus = utility_service.csv_to_list(admin_link['authorities'])
-            admin_menu_roles.extend(plus if plus else [])
+    # Admin links are pre-compiled. Only keep the ones the user is allowed to see
+    admin_links = AdminLink.get_allowed()
 
-    has_it = auth_service.has_authority(admin_menu_roles)
+    has_it = bool(admin_links)
     var_name = args[0] if len(args) > 0 else 'admin_menu'
+    context[f"{var_name}_links"] = admin_links
     context[f"has_{var_name}"] = has_it
     context[f"does_not_have_{var_name}"] = not has_it
     return ''
@@ -1,6 +1,7 @@
 from django import template
 from django.db.models.query import QuerySet
 from ...classes.log import Log
+from ...classes.admin_link import AdminLink
 from ...services import utility_service, error_service, auth_service
 from . import supporting_functions as support
 from ...context_processors import util as util_context
@@ -553,6 +554,15 @@ class HeaderNavMenuItem(template.Node):
 
         # A map of attributes may be accepted in place of individual attributes
         attributes = attrs.get('attributes')
+
+        # Pre-compiled admin links have their authorities split and their URL reversed already
+        if isinstance(attributes, AdminLink):
+            if not attributes.is_allowed():
+                return ''
+            path = attributes.path
+            is_active = path is not None and path == context.request.path
+            return self.link_html(path, attributes.label, attributes.icon, is_active)
+
         if attributes:
             attrs.update(attributes)
 
@@ -614,6 +624,10 @@ class HeaderNavMenuItem(template.Node):
             except Exception as ee:
                 log.debug(f"Path comparison error: {str(ee)}")
 
+        return self.link_html(path, label, icon, is_active)
+
+    @staticmethod
+    def link_html(path, label, icon, is_active):
         if is_active:
             classes = 'dropdown-item active'
         else:
@@ -668,6 +682,8 @@ def pagination(paginated_results):
         'start_item': start_item,
         'end_item': end_item,
         'num_items': num_items,
+        # Signed pagination state, if pagination_sort_info is not using the session
+        'state_param': utility_service.get_pagination_state_param(),
     }
 
 
@@ -694,9 +710,15 @@ class SortableThNode(template.Node):
 
         # Last-sorted column was saved in utility_service.pagination_sort_info()
         # This assumes only one sorted dataset is being displayed at a time
-        sorted_col = utility_service.get_session_var('mjg_last_sorted_column')
-        sorted_secondary_col = utility_service.get_session_var('mjg_last_secondary_sorted_column')
-        sorted_dir = utility_service.get_session_var('mjg_last_sorted_direction')
+        pagination_state = utility_service.get_page_scope('pagination_state')
+        if pagination_state:
+            sorted_col = pagination_state['sorted_column']
+            sorted_secondary_col = pagination_state['secondary_sorted_column']
+            sorted_dir = pagination_state['sorted_direction']
+        else:
+            sorted_col = utility_service.get_session_var('mjg_last_sorted_column')
+            sorted_secondary_col = utility_service.get_session_var('mjg_last_secondary_sorted_column')
+            sorted_dir = utility_service.get_session_var('mjg_last_sorted_direction')
 
         fa = title = None
         if sorted_col and sorted_dir:
@@ -710,7 +732,7 @@ class SortableThNode(template.Node):
 
         pieces = [
             """<th scope="col">""",
-            f"""<a href="?sort={column}">{heading}</a>""",
+            f"""<a href="?sort={column}{utility_service.get_pagination_state_param()}">{heading}</a>""",
             f"""&nbsp;<span class="{fa}" aria-hidden="true" title="{title}"></span>""" if fa else '',
             """</th>"""
         ]
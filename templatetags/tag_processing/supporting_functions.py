@@ -53,9 +53,7 @@ def process_args(p_args, context=None, p_allow_no_key=True):
                                 var_val = var_str.resolve(context)
                                 val = val.replace(mm, str(var_val))
                 except Exception as ee:
-                    log.error(
-                        ee, "Converting nested variable in template-tag"
-                    )
+                    log.error("Converting nested variable in template-tag: %s", ee)
 
             # Non-quoted values must be converted to their true values
             else:
@@ -1,3 +1,485 @@
-from django.test import TestCase
+from django.test import TestCase, RequestFactory, override_settings
+from django.contrib.auth.models import User, AnonymousUser
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control
+from django.contrib.auth import logout
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from importlib import import_module
+from urllib.parse import urlencode
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import logging
+import queue
+import threading
+import time
+import timeit
+from .classes.auth import Auth, request_attr, session_var
+from .classes.dynamic_role import DynamicRole
+from .classes.auth_user import AuthUser
+from .classes.session_facade import SessionFacade
+from .classes import log_queue
+from .models.auth.authority import Authority
+from .models.auth.permission import Permission
+from .models.contact.contact import Contact
+from .models.utility.feature import Feature
+from .middleware.mjg_base_middleware import MjgBaseMiddleware
+from .middleware.mjg_security_middleware import xss_prevention
+from .services import auth_service, utility_service, permission_service, gravatar_service
 
-# Create your tests here.
+
+class AuthInstanceTests(TestCase):
+    """
+    Auth is built once per request, and re-used by every auth_service call
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('tester', 'tester@example.com', 'password')
+
+    def test_one_auth_per_request(self):
+        self.client.force_login(self.user)
+        with mock.patch.object(Auth, '__init__', autospec=True, side_effect=Auth.__init__) as auth_init:
+            response = self.client.get(reverse('base:status'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(auth_init.call_count, 1)
+
+    def test_auth_service_calls_reuse_instance(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+
+        token = utility_service.set_request(request)
+        try:
+            with mock.patch.object(Auth, '__init__', autospec=True, side_effect=Auth.__init__) as auth_init:
+                auth_service.get_user()
+                self.assertEqual(auth_init.call_count, 1)
+
+                # Once built, no further construction or queries are needed
+                with self.assertNumQueries(0):
+                    for ii in range(20):
+                        auth_service.is_logged_in()
+                        auth_service.get_user()
+                        auth_service.has_authority('admin')
+                        auth_service.has_authority('~power_user')
+
+                self.assertEqual(auth_init.call_count, 1)
+        finally:
+            utility_service.reset_request(token)
+
+    def test_auth_rebuilt_after_logout(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+
+        token = utility_service.set_request(request)
+        try:
+            self.assertTrue(auth_service.is_logged_in())
+            self.assertTrue(hasattr(request, request_attr))
+
+            logout(request)
+            self.assertFalse(hasattr(request, request_attr))
+            self.assertFalse(auth_service.is_logged_in())
+        finally:
+            utility_service.reset_request(token)
+
+
+class AsgiMiddlewareTests(TestCase):
+    """
+    The mjg_base middlewares run natively in an async (ASGI) middleware chain
+    """
+
+    async def test_middleware_stack_under_asgi(self):
+        with mock.patch.object(
+                MjgBaseMiddleware, '__acall__', autospec=True, side_effect=MjgBaseMiddleware.__acall__
+        ) as acall:
+            response = await self.async_client.get(reverse('base:status'))
+
+        # Base middleware ran its async variant, and the security middleware added its headers
+        self.assertEqual(acall.call_count, 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-XSS-Protection'], "1")
+
+        # Request context (contextvar) is cleared once the response is complete
+        self.assertIsNone(utility_service.current_request.get())
+
+    async def test_xss_blocked_under_asgi(self):
+        # Query string is part of the path: Django 3.2's AsyncClient ignores GET data
+        query = urlencode({'q': "<script>alert('x')</script>"})
+        response = await self.async_client.get(f"{reverse('base:status')}?{query}")
+        self.assertRedirects(response, reverse('base:xss_block'), fetch_redirect_response=False)
+
+
+class DynamicRoleTests(TestCase):
+    """
+    Roles from the project's DYNAMIC_ROLES setting are added to the built-in roles
+    """
+
+    @override_settings(DYNAMIC_ROLES={'reviewer': ['qa'], 'proxy': ['helpdesk']})
+    def test_project_roles_extend_built_in_roles(self):
+        self.assertEqual(DynamicRole.get_name('~reviewer'), 'reviewer')
+        self.assertEqual(DynamicRole.get('~reviewer'), ['qa'])
+        self.assertEqual(DynamicRole.get('~proxy'), ['admin', 'helpdesk', 'proxy'])
+        for role_name in ['power_user', 'superuser', 'impersonate', 'security_admin', 'contact_admin']:
+            self.assertEqual(DynamicRole.get_name(f"~{role_name}"), role_name)
+
+
+class BulkLoadTests(TestCase):
+    """
+    AuthUser.bulk_load uses a fixed number of queries, regardless of how many users are loaded
+    """
+
+    def setUp(self):
+        self.authority = Authority.objects.create(code='admin', title="Administrator")
+        self.users = []
+        for ii in range(6):
+            user = User.objects.create_user(f"user{ii}", f"user{ii}@example.com", 'password')
+            Permission.objects.create(user=user, authority=self.authority)
+            self.users.append(user)
+
+    def test_bulk_load_query_count(self):
+        user_data = [uu.id for uu in self.users[:5]] + [self.users[5].email]
+        with self.assertNumQueries(2):
+            auth_users = AuthUser.bulk_load(user_data)
+
+        self.assertEqual([au.email for au in auth_users], [uu.email for uu in self.users])
+        for au in auth_users:
+            self.assertEqual(au.authority_codes, ['admin'])
+            self.assertTrue(au.has_authority('~power_user'))
+            # Snapshot carries the permissions version, so a resumed copy does not reload authorities
+            self.assertEqual(au.permissions_version, permission_service.get_version(au.id))
+            self.assertFalse(AuthUser(au.to_dict()).refreshed)
+
+    def test_authorized_users_query_count(self):
+        self.client.force_login(self.users[0])
+        url = reverse('base:authorized_users', args=[self.authority.id])
+
+        Permission.objects.filter(user__in=self.users[1:]).delete()
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as one_user:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        for uu in self.users[1:]:
+            Permission.objects.create(user=uu, authority=self.authority)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as six_users:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.users[5].email)
+
+        self.assertEqual(len(six_users), len(one_user))
+
+
+class ContactProvisioningTests(TestCase):
+    """
+    Contacts are not created while authenticating, and display names are served from the session snapshot
+    """
+
+    def test_existing_contact_names_saved_at_login(self):
+        Contact.objects.create(email='jdoe@example.com', first_name='Jane', last_name='Doe')
+        user = User.objects.create_user('jdoe', 'jdoe@example.com', 'password')
+        self.client.force_login(user)
+
+        response = self.client.get(reverse('base:status'))
+        self.assertContains(response, 'Jane Doe')
+        snapshot = self.client.session[f"{utility_service.session_prefix}{session_var}"]['authenticated_user']
+        self.assertEqual((snapshot['first_name'], snapshot['last_name']), ('Jane', 'Doe'))
+        self.assertEqual(Contact.objects.get(email='jdoe@example.com').user_id, user.id)
+
+    def test_no_contact_queries_after_login(self):
+        user = User.objects.create_user('tester', 'tester@example.com', 'password', first_name='Test', last_name='User')
+        self.client.force_login(user)
+
+        # New contacts are only created on first use of contact()
+        response = self.client.get(reverse('base:status'))
+        self.assertContains(response, 'Test User')
+        self.assertFalse(Contact.objects.exists())
+
+        # Resumed users do not query the User or Contact to display their name
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('base:status'))
+        self.assertContains(response, 'Test User')
+        contact_queries = [qq['sql'] for qq in queries if 'mjg_base_contact' in qq['sql']]
+        self.assertEqual(contact_queries, [])
+
+
+class StubGravatarHandler(BaseHTTPRequestHandler):
+    """
+    Local stand-in for gravatar.com: one known image, a slow response, and 404 for everyone else
+    """
+    image = b"GIF89a-stub-image"
+    known_hash = gravatar_service.get_email_hash('known@example.com')
+    slow_hash = gravatar_service.get_email_hash('slow@example.com')
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        if self.path.startswith(f"/avatar/{self.slow_hash}"):
+            time.sleep(2)
+        if self.path.startswith(f"/avatar/{self.known_hash}?"):
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/gif')
+            self.send_header('Content-Length', str(len(self.image)))
+            self.end_headers()
+            self.wfile.write(self.image)
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class GravatarTests(TestCase):
+    """
+    Gravatar images are fetched (against a local stub server), cached, and served locally
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubGravatarHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.settings_override = override_settings(
+            GRAVATAR_URL=f"http://127.0.0.1:{cls.server.server_port}/avatar/", GRAVATAR_TIMEOUT=(0.5, 0.5)
+        )
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        StubGravatarHandler.requests.clear()
+
+    def test_fetch_and_serve_image(self):
+        image_hash = gravatar_service.fetch(StubGravatarHandler.known_hash)
+        self.assertEqual(image_hash, hashlib.sha256(StubGravatarHandler.image).hexdigest())
+
+        image_src = gravatar_service.get_image_src('Known@Example.com ')
+        self.assertEqual(image_src, reverse('base:gravatar', args=[image_hash]))
+
+        response = self.client.get(image_src)
+        self.assertEqual(response.content, StubGravatarHandler.image)
+        self.assertEqual(response['Content-Type'], 'image/gif')
+        self.assertEqual(response['Cache-Control'], "public, max-age=31536000, immutable")
+        self.assertFalse(response.has_header('Pragma'))
+
+        # Every other response still gets the no-store security headers
+        response = self.client.get(reverse('base:status'))
+        self.assertEqual(response['Cache-Control'], "no-store")
+        self.assertEqual(response['Pragma'], "no-cache")
+
+    def test_view_cache_control_keeps_no_store(self):
+        def view(request):
+            response = HttpResponse("private")
+            patch_cache_control(response, private=True, max_age=600)
+            return response
+
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+        token = utility_service.set_request(request)
+        try:
+            response = xss_prevention(view)(request)
+        finally:
+            utility_service.reset_request(token)
+
+        self.assertEqual(response['Cache-Control'], "no-store")
+        self.assertEqual(response['Pragma'], "no-cache")
+
+    def test_avatar_url_falls_back_to_gravatar(self):
+        image_hash = gravatar_service.fetch(StubGravatarHandler.known_hash)
+        request = RequestFactory().get('/')
+        request.user = User.objects.create_user('known', 'known@example.com', 'password')
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+        token = utility_service.set_request(request)
+        try:
+            self.assertEqual(auth_service.get_avatar_url(), reverse('base:gravatar', args=[image_hash]))
+        finally:
+            utility_service.reset_request(token)
+
+    def test_background_fetch(self):
+        # First request starts a background fetch, and does not wait for it
+        self.assertIsNone(gravatar_service.get_image_src('known@example.com'))
+        for ii in range(50):
+            image_src = gravatar_service.get_image_src('known@example.com')
+            if image_src:
+                break
+            time.sleep(0.1)
+        self.assertIsNotNone(image_src)
+        self.assertEqual(len(StubGravatarHandler.requests), 1)
+
+    def test_missing_image_is_cached(self):
+        email_hash = gravatar_service.get_email_hash('nobody@example.com')
+        self.assertEqual(gravatar_service.fetch(email_hash), '')
+        self.assertIsNone(gravatar_service.get_image_src('nobody@example.com'))
+        self.assertEqual(len(StubGravatarHandler.requests), 1)
+
+    def test_slow_response_times_out(self):
+        start = time.perf_counter()
+        self.assertEqual(gravatar_service.fetch(StubGravatarHandler.slow_hash), '')
+        self.assertLess(time.perf_counter() - start, 1.5)
+
+
+class RequestCacheTests(TestCase):
+    """
+    Request-scoped memoization (store/recall and @request_cached), and its per-call cost
+    """
+
+    def setUp(self):
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+        self.token = utility_service.set_request(request)
+        utility_service.clear_page_scope()
+
+    def tearDown(self):
+        utility_service.clear_page_scope()
+        utility_service.reset_request(self.token)
+
+    def test_store_recall(self):
+        self.assertIsNone(utility_service.test_store_recall())
+        utility_service.test_store_recall('stored')
+        self.assertEqual(utility_service.test_store_recall(), 'stored')
+
+    def test_request_cached(self):
+        calls = []
+
+        @utility_service.request_cached
+        def lookup(value):
+            calls.append(value)
+            return value * 2
+
+        self.assertEqual([lookup(2), lookup(2), lookup(3)], [4, 4, 6])
+        self.assertEqual(calls, [2, 3])
+        lookup.clear_request_cache()
+        lookup(2)
+        self.assertEqual(calls, [2, 3, 2])
+
+    def test_per_call_cost(self):
+        """
+        Benchmark: with inspect.stack(), a cache key took 1.3-2.0 ms (10-40 frames deep) and a cached
+        feature-toggle lookup 4.9-6.8 ms. Both now take about a microsecond. Limits are set well above that.
+        """
+        def at_depth(depth, fn):
+            # A Django view runs about 40 frames deep
+            return at_depth(depth - 1, fn) if depth else fn()
+
+        Feature.get_feature_toggles()
+        with self.assertNumQueries(0):
+            for fn in [utility_service.test_cache_key, Feature.get_feature_toggles]:
+                seconds = min(timeit.repeat(lambda: at_depth(40, fn), number=500, repeat=3)) / 500
+                self.assertLess(seconds, 0.0001, fn.__qualname__)
+
+
+class SessionFacadeTests(TestCase):
+    """
+    Buffered session variables are written once, at the end of the request, and only to the session they belong to
+    """
+
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+        self.request.user = AnonymousUser()
+        self.request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+        self.request.session['existing'] = True
+        self.request.session.save()
+        self.token = utility_service.set_request(self.request)
+
+    def tearDown(self):
+        utility_service.reset_request(self.token)
+
+    def test_buffer_dropped_when_session_flushed(self):
+        utility_service.set_session_var('before', 1)
+        self.request.session.flush()
+        utility_service.set_session_var('after', 2)
+
+        self.assertEqual(utility_service.flush_session_vars(), 1)
+        self.assertNotIn(f"{utility_service.session_prefix}before", self.request.session)
+        self.assertEqual(self.request.session[f"{utility_service.session_prefix}after"], 2)
+
+    def test_buffer_dropped_when_session_cycled(self):
+        utility_service.set_session_var('before', 1)
+        self.request.session.cycle_key()
+
+        self.assertEqual(utility_service.flush_session_vars(), 0)
+        self.assertNotIn(f"{utility_service.session_prefix}before", self.request.session)
+
+    def test_clear_custom_session_vars(self):
+        utility_service.set_session_var('kept', 'yes')
+        utility_service.set_session_var('dropped', 'no')
+        requests = SessionFacade.get_stats()['requests']
+
+        utility_service.clear_custom_session_vars(preserve='kept')
+        utility_service.flush_session_vars()
+
+        self.assertEqual(self.request.session[f"{utility_service.session_prefix}kept"], 'yes')
+        self.assertNotIn(f"{utility_service.session_prefix}dropped", self.request.session)
+        # One request, counted once
+        self.assertEqual(SessionFacade.get_stats()['requests'], requests + 1)
+
+    def test_stats_count_bytes(self):
+        value = {'name': "Zoë", 'items': [1, 2, 3]}
+        utility_service.set_session_var('stats_test-value', value)
+        utility_service.flush_session_vars()
+
+        size = SessionFacade.get_stats()['prefix_bytes'][f"{utility_service.session_prefix}stats_test"]
+        self.assertEqual(size, len(SessionFacade._serialize(value).encode()))
+
+
+class LogQueueTests(TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('mjg_base_test')
+        self.handler = logging.NullHandler()
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        for name in ['mjg_base_test', 'mjg_base_test.timeline']:
+            listener = log_queue.listeners.pop(name, None)
+            if listener:
+                listener.stop()
+            logger = logging.getLogger(name)
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+            logger.propagate = True
+
+    def test_install_skips_logger_that_already_reaches_a_queue(self):
+        self.assertIsNotNone(log_queue.install('mjg_base_test'))
+
+        # The child propagates to the installed parent's queue handler. A second listener would do nothing useful
+        self.assertIsNone(log_queue.install('mjg_base_test.timeline'))
+        self.assertNotIn('mjg_base_test.timeline', log_queue.listeners)
+        self.assertTrue(logging.getLogger('mjg_base_test.timeline').propagate)
+
+    def test_dropped_count_is_exact_across_threads(self):
+        handler = log_queue.BoundedQueueHandler(queue.Queue(maxsize=1))
+        handler.queue.put_nowait(None)
+        record = logging.LogRecord('mjg_base_test', logging.INFO, __file__, 0, "test", None, None)
+
+        def log_many():
+            for ii in range(2000):
+                handler.enqueue(record)
+
+        threads = [threading.Thread(target=log_many) for ii in range(8)]
+        for tt in threads:
+            tt.start()
+        for tt in threads:
+            tt.join()
+        self.assertEqual(handler.dropped, 16000)
+
+        # Once there is room, the drops are reported and the count starts over
+        handler.queue.get_nowait()
+        handler.enqueue(record)
+        self.assertIn("Dropped 16000", handler.queue.get_nowait().getMessage())
+        self.assertEqual(handler.dropped, 1)
@@ -9,6 +9,9 @@ urlpatterns = [
     # Messages
     path('messages', views.messages, name='messages'),
 
+    # Cached Gravatar images
+    path('gravatar/<str:image_hash>', views.gravatar_image, name='gravatar'),
+
     # Authentication
     path('router', views.post_login_handler, name='post_login_handler'),
 
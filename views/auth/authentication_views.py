@@ -2,6 +2,7 @@ from django.shortcuts import redirect, render
 from django.http import HttpResponseForbidden, HttpResponse
 from ...classes.log import Log
 from ...services import auth_service, error_service, utility_service
+from ...classes.auth_user import AuthUser
 from ...decorators import require_impersonation_authority, require_authority, require_authentication
 
 
@@ -48,14 +49,15 @@ def proxy_search(request):
     found = None
 
     if request.method == 'POST' and request.POST.get('proxy_info'):
-        pass
+        if auth_service.start_proxying(request.POST.get('proxy_info')):
+            return redirect(request.GET.get('next', '/'))
 
-    # elif request.method == 'POST' and request.POST.get('search_info'):
-    #     # Look up user from given data
-    #     found = User(request.POST.get('search_info'))
+    elif request.method == 'POST' and request.POST.get('search_info'):
+        # Look up users from the given IDs and/or email addresses (all at once)
+        found = AuthUser.bulk_load(utility_service.csv_to_list(request.POST.get('search_info')) or [])
 
     return render(
-        request, 'auth/proxy_search.html',
+        request, 'base/auth/proxy_search.html',
         {'found': found}
     )
 
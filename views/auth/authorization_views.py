@@ -7,6 +7,7 @@ from ...decorators import require_impersonation_authority, require_authority, re
 from django.contrib.auth.models import User
 from mjg_base.models.auth.authority import Authority
 from mjg_base.models.auth.permission import Permission
+from mjg_base.classes.auth_user import AuthUser
 from django.core.paginator import Paginator
 from datetime import datetime
 from django.db.models import Q
@@ -42,7 +43,12 @@ def authorized_users(request, authority_id=None):
     permissions = Permission.objects.filter(authority__id=authority_id)
     permissions = permissions.filter(Q(effective_date__isnull=True) | Q(effective_date__lte=now))
     permissions = permissions.filter(Q(end_date__isnull=True) | Q(end_date__gt=now))
-    permissions = permissions.order_by('user__last_name').order_by('user__first_name')
+    permissions = list(permissions.order_by('user__last_name').order_by('user__first_name'))
+
+    # Load all authorized users at once, rather than one query per permission
+    users = {au.id: au for au in AuthUser.bulk_load([pp.user_id for pp in permissions])}
+    for pp in permissions:
+        pp.auth_user = users.get(pp.user_id)
 
     return render(
         request, 'base/auth/authorized_users.html',
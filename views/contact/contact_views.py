@@ -4,7 +4,7 @@ from ...classes.log import Log
 from ...services import auth_service, error_service, message_service, utility_service
 from mjg_base.models import Contact, Address, Phone
 from mjg_base.decorators import require_authority, require_authentication
-from django.db.models import Q
+from django.db.models import Q, Prefetch
 from django.core.paginator import Paginator
 
 
@@ -31,7 +31,10 @@ def contact_list(request):
     else:
         contacts = Contact.objects.all()
 
-    contacts = contacts.order_by(*sort)
+    # Phones are formatted by the database rather than per table cell
+    contacts = contacts.order_by(*sort).prefetch_related(
+        Prefetch('phones', queryset=Phone.objects.with_formatted_numbers())
+    )
     paginator = Paginator(contacts, 50)
     contacts = paginator.get_page(page)
 
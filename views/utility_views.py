@@ -1,6 +1,7 @@
 from django.shortcuts import render
+from django.http import HttpResponse, Http404
 from ..classes.log import Log
-from ..services import date_service, utility_service
+from ..services import date_service, utility_service, gravatar_service
 import time
 from datetime import datetime
 
@@ -27,6 +28,21 @@ def status_page(request):
             'server_time': datetime.now(),
             'session_data': session_data,
             'installed_plugins': utility_service.get_installed_plugins(),
+            'session_stats': utility_service.get_session_stats(),
         }
     )
 
+
+def gravatar_image(request, image_hash):
+    """
+    Serve a Gravatar image that was fetched by gravatar_service
+    """
+    image = gravatar_service.get_image(image_hash)
+    if not image:
+        raise Http404()
+    response = HttpResponse(image['content'], content_type=image['content_type'])
+
+    # The URL is the hash of the image content, so it never changes (exempt from the no-store security header)
+    response['Cache-Control'] = "public, max-age=31536000, immutable"
+    response.content_addressed = True
+    return response